@@ -3,6 +3,9 @@ ASGI config for DjangoWeatherReminder project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Live weather updates (``/api/live/weather/``) are served by a lightweight Server-Sent Events app
+that bypasses the Django request cycle; everything else goes to Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +16,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoWeatherReminder.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from weather.live import LIVE_PATH, live_weather_app  # noqa: E402  (needs the app registry)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == LIVE_PATH:
+        await live_weather_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
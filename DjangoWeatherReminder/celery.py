@@ -1,11 +1,74 @@
 import os
 from celery import Celery
+from celery.signals import import_modules, task_postrun, task_prerun
+from kombu import Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoWeatherReminder.settings')
 
 app = Celery('DjangoWeatherReminder')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
+
+# Each stage of a notification runs on its own queue, so a slow SMTP server or webhook
+# endpoint only backs up its own workers. Start one worker group per queue, e.g.:
+#   celery -A DjangoWeatherReminder worker -Q weather -c 8
+#   celery -A DjangoWeatherReminder worker -Q email -c 4
+#   celery -A DjangoWeatherReminder worker -Q webhook -c 16
+WEATHER_QUEUE = 'weather'
+EMAIL_QUEUE = 'email'
+WEBHOOK_QUEUE = 'webhook'
+
+# With the Redis transport 0 is the highest priority.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 3
+PRIORITY_LOW = 6
+
+app.conf.task_default_queue = WEATHER_QUEUE
+app.conf.task_default_priority = PRIORITY_NORMAL
+app.conf.task_queues = (
+    Queue(WEATHER_QUEUE, routing_key=WEATHER_QUEUE),
+    Queue(EMAIL_QUEUE, routing_key=EMAIL_QUEUE),
+    Queue(WEBHOOK_QUEUE, routing_key=WEBHOOK_QUEUE),
+)
+# With NOTIFICATION_SHARDS set, the notification work of each city goes to the shard queue picked by
+# consistent hashing (DjangoWeatherReminder.sharding), e.g. one worker group per shard:
+#   celery -A DjangoWeatherReminder worker -Q notify-0 -c 8
+TASK_ROUTES = {
+    'users.tasks.check_due_subscriptions': {'queue': WEATHER_QUEUE, 'priority': PRIORITY_HIGH},
+    'users.tasks.send_weather_notification': {'queue': WEATHER_QUEUE, 'priority': PRIORITY_NORMAL},
+    'users.tasks.send_city_notifications': {'queue': WEATHER_QUEUE, 'priority': PRIORITY_NORMAL},
+    'users.tasks.send_email_notification': {'queue': EMAIL_QUEUE, 'priority': PRIORITY_NORMAL},
+    'users.tasks.send_webhook_notification': {'queue': WEBHOOK_QUEUE, 'priority': PRIORITY_LOW},
+    'weather.tasks.refresh_subscribed_forecasts': {'queue': WEATHER_QUEUE, 'priority': PRIORITY_LOW},
+}
+app.conf.task_routes = ('DjangoWeatherReminder.sharding.route_notification', TASK_ROUTES)
+app.conf.broker_transport_options = {
+    'priority_steps': [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, 9],
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+
+# Only the apps that define tasks are searched, instead of every installed app.
+app.autodiscover_tasks(['users', 'weather'])
+
+
+@import_modules.connect
+def register_control_commands(**kwargs):
+    # Sent by workers once Django is set up; web processes never load the worker control module.
+    from celery.worker.control import inspect_command
+    from users.shard_cache import shard_cache_stats
+    inspect_command()(shard_cache_stats)
+
+
+@task_prerun.connect
+def profile_task_started(**kwargs):
+    from DjangoWeatherReminder.profiling import task_started
+    task_started(**kwargs)
+
+
+@task_postrun.connect
+def profile_task_finished(**kwargs):
+    from DjangoWeatherReminder.profiling import task_finished
+    task_finished(**kwargs)
 
 
 @app.task(bind=True, ignore_result=True)
@@ -0,0 +1,90 @@
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+
+LOCK_EXPIRE = 60
+
+# Both scripts only touch the key while it still holds our token, so a lock that expired and was
+# taken over by another worker is never released or extended by its previous owner.
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class CacheLock:
+    """
+    A token-owned lock stored in the shared cache.
+
+    On the Redis cache backend the lock is a plain ``SET NX EX`` key, released and renewed with
+    compare-and-delete / compare-and-expire scripts. LocMemCache (tests) uses the regular cache API,
+    which gives the same semantics within one process. Any other backend is refused.
+    """
+
+    def __init__(self, key: str, expire: int = LOCK_EXPIRE, cache=None):
+        self.cache = cache or caches['default']
+        if not isinstance(self.cache, (RedisCache, LocMemCache)):
+            raise ImproperlyConfigured(f"CacheLock needs RedisCache or LocMemCache, not {type(self.cache).__name__}")
+        self.key = key
+        self.expire = expire
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def _redis(self):
+        """Returns the raw Redis client and full key, or None on LocMemCache."""
+        if not isinstance(self.cache, RedisCache):
+            return None
+        # RedisCache has no public client accessor; get_client is what its own methods use.
+        return self.cache._cache.get_client(self.key, write=True), self.cache.make_and_validate_key(self.key)
+
+    def acquire(self) -> bool:
+        redis = self._redis()
+        if redis:
+            client, key = redis
+            self.acquired = bool(client.set(key, self.token, nx=True, ex=self.expire))
+        else:
+            self.acquired = self.cache.add(self.key, self.token, self.expire)
+        return self.acquired
+
+    def release(self) -> bool:
+        if not self.acquired:
+            return False
+        self.acquired = False
+        redis = self._redis()
+        if redis:
+            client, key = redis
+            return bool(client.eval(RELEASE_SCRIPT, 1, key, self.token))
+        if self.cache.get(self.key) == self.token:
+            return self.cache.delete(self.key)
+        return False
+
+    def renew(self, expire: int | None = None) -> bool:
+        """Extends the lock of a long-running task. Returns False if the lock is no longer ours."""
+        if not self.acquired:
+            return False
+        expire = expire or self.expire
+        redis = self._redis()
+        if redis:
+            client, key = redis
+            self.acquired = bool(client.eval(RENEW_SCRIPT, 1, key, self.token, expire))
+        else:
+            self.acquired = self.cache.get(self.key) == self.token and self.cache.touch(self.key, expire)
+        return self.acquired
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
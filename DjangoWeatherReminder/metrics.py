@@ -0,0 +1,51 @@
+from django.db import connections
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+def database_metrics() -> dict:
+    """
+    Collects connection usage for every configured database in the current process.
+
+    Returns:
+        dict: Per-alias stats. Pooled aliases report the psycopg pool counters and the share of
+        the pool that is checked out; the others report whether a persistent connection is open.
+    """
+    metrics = {}
+    for conn in connections.all(initialized_only=True):
+        pool = getattr(conn, 'pool', None)
+        if pool is None:
+            metrics[conn.alias] = {
+                'pooled': False,
+                'conn_max_age': conn.settings_dict['CONN_MAX_AGE'],
+                'connected': conn.connection is not None,
+            }
+            continue
+        stats = pool.get_stats()
+        in_use = stats.get('pool_size', 0) - stats.get('pool_available', 0)
+        metrics[conn.alias] = {
+            'pooled': True,
+            'in_use': in_use,
+            'utilization': round(in_use / pool.max_size, 3),
+            **stats,
+        }
+    return metrics
+
+
+class DatabaseMetricsView(APIView):
+    """An admin-only API view exposing the database connection usage of the worker serving the request."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(database_metrics())
+
+
+class ProviderMetricsView(APIView):
+    """An admin-only API view exposing the weather provider latencies, failures and hedges of the serving worker."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        from weather.providers import get_providers
+
+        return Response(get_providers().stats())
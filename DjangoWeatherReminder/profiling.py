@@ -0,0 +1,181 @@
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOP_FUNCTIONS = 25
+
+_current = ContextVar('profile', default=None)
+# Since Python 3.12 only one cProfile can be enabled per interpreter, and it sees the calls of every thread,
+# so at most one block per process is sampled at a time.
+_sampling = threading.Lock()
+
+
+class Profile:
+    """Time spent by one request or task: wall clock, SQL queries and upstream HTTP calls."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.budget = None
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.queries > self.budget
+
+    def server_timing(self) -> str:
+        """Formats the profile as a Server-Timing header value."""
+        return (
+            f'db;dur={self.query_seconds * 1000:.1f};desc="{self.queries} queries", '
+            f'upstream;dur={self.upstream_seconds * 1000:.1f};desc="{self.upstream_calls} calls", '
+            f'total;dur={self.wall_seconds * 1000:.1f}'
+        )
+
+
+@contextmanager
+def profile(name: str, budget: int | None = None):
+    """
+    Profiles the enclosed block and logs a summary line when it ends.
+
+    Queries of every database connection of the current thread are counted. A share of the blocks
+    (PROFILING_SAMPLE_RATE) also runs under cProfile, whose top functions are logged when the block
+    took longer than PROFILING_SLOW_MS. A block is not sampled while another one of the process is.
+
+    Args:
+        name (str): View or task name used in the log.
+        budget (int | None): Queries the block is expected to stay within; exceeding it logs a warning.
+
+    Yields:
+        Profile: The running profile.
+    """
+    result = Profile(name)
+    result.budget = budget
+    token = _current.set(result)
+    profiler = None
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(result.record_query))
+            if random.random() < settings.PROFILING_SAMPLE_RATE and _sampling.acquire(blocking=False):
+                stack.callback(_sampling.release)
+                profiler = cProfile.Profile()
+                profiler.enable()
+                stack.callback(profiler.disable)
+            yield result
+    finally:
+        result.wall_seconds = time.perf_counter() - started
+        _current.reset(token)
+        logger.info(
+            "%s wall=%.1fms queries=%d db=%.1fms upstream_calls=%d upstream=%.1fms",
+            result.name, result.wall_seconds * 1000, result.queries, result.query_seconds * 1000,
+            result.upstream_calls, result.upstream_seconds * 1000,
+        )
+        if result.over_budget:
+            logger.warning("%s ran %d queries, over its budget of %d", result.name, result.queries, result.budget)
+        if profiler and result.wall_seconds * 1000 >= settings.PROFILING_SLOW_MS:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            logger.info("Slow %s profile:\n%s", result.name, stream.getvalue())
+
+
+@contextmanager
+def upstream():
+    """Attributes the enclosed HTTP call to the current profile, if any."""
+    current = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None:
+            current.upstream_calls += 1
+            current.upstream_seconds += time.perf_counter() - started
+
+
+def view_query_budget(view_func) -> int | None:
+    """Returns the `query_budget` declared by the class of a view function, if any."""
+    view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+    return getattr(view_class, 'query_budget', None)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles every request when PROFILING_ENABLED is set.
+
+    The summary is logged and returned in a Server-Timing header; views declaring a `query_budget`
+    get a warning logged whenever a request exceeds it.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile(f"{request.method} {request.path}") as current:
+            response = self.get_response(request)
+        response['Server-Timing'] = current.server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current = _current.get()
+        if current is not None:
+            current.name = f"{request.method} {request.resolver_match.view_name}"
+            current.budget = view_query_budget(view_func)
+
+
+_task_profiles = {}
+
+
+def task_started(task_id=None, task=None, **kwargs):
+    """Celery task_prerun handler starting a profile of the task."""
+    if settings.PROFILING_ENABLED:
+        stack = ExitStack()
+        stack.enter_context(profile(task.name, getattr(task, 'query_budget', None)))
+        _task_profiles[task_id] = stack
+
+
+def task_finished(task_id=None, **kwargs):
+    """Celery task_postrun handler logging the profile of the task."""
+    stack = _task_profiles.pop(task_id, None)
+    if stack is not None:
+        stack.close()
+
+
+@contextmanager
+def query_budget(testcase, budget: int):
+    """
+    Test helper failing when the enclosed block runs more than `budget` queries.
+
+    Unlike `assertNumQueries`, fewer queries pass, so an optimization does not break the test.
+    """
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connections['default']) as captured:
+        yield captured
+    if len(captured) > budget:
+        queries = "\n".join(f"{i}. {query['sql']}" for i, query in enumerate(captured.captured_queries, start=1))
+        testcase.fail(f"{len(captured)} queries executed, budget is {budget}:\n{queries}")
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
@@ -50,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'DjangoWeatherReminder.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,7 +65,7 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'users.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -108,9 +111,27 @@ DATABASES = {
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST", "127.0.0.1"),
         'PORT': os.getenv("DB_PORT", "5432"),
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Connection reuse is sized per process type through the environment (see compose.yaml):
+# gunicorn gthread workers share a psycopg pool per process, one slot per thread, while
+# Celery prefork workers run one task at a time and keep a single persistent connection.
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "0"))
+
+if DB_POOL_MAX_SIZE:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.getenv("DB_POOL_TIMEOUT", "10")),
+            'max_idle': 300,
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -202,10 +223,70 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
 }
 
-# Celery Configuration Options
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = os.getenv("REDIS_PORT", "6379")
 
+TESTING = sys.argv[1:2] == ['test']
+
+# Cache
+# Shared by every process, so task locks (DjangoWeatherReminder.locks) are mutually exclusive
+# across all web and Celery workers. Tests run against a local in-memory cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/1',
+        'KEY_PREFIX': 'dwr',
+        'OPTIONS': {
+            'max_connections': int(os.getenv('REDIS_CACHE_MAX_CONNECTIONS', '20')),
+            'socket_connect_timeout': 2,
+            'socket_timeout': 2,
+            'health_check_interval': 30,
+        },
+    }
+}
+
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Weather
+# Fetched observations are cached immediately and written to WeatherRecord in batches,
+# at most this many seconds after the first pending write (0 writes straight through).
+WEATHER_FLUSH_SECONDS = float(os.getenv('WEATHER_FLUSH_SECONDS', '0' if TESTING else '2'))
+WEATHER_FLUSH_BATCH = int(os.getenv('WEATHER_FLUSH_BATCH', '200'))
+# Cities are fetched per grid cell of this many degrees (0.05 is about 5.5 km north-south), so places a
+# few kilometres apart share one upstream call. 0 only shares between identical coordinates.
+WEATHER_GRID_DEGREES = float(os.getenv('WEATHER_GRID_DEGREES', '0.05'))
+
+# Weather providers (weather.providers), in order of preference: the first is the primary, the others
+# receive hedged requests when it is slow and take over when it fails.
+WEATHER_PROVIDERS = os.getenv('WEATHER_PROVIDERS', 'openweathermap' if TESTING else 'openweathermap,open-meteo').split(',')
+API_KEY = os.getenv('API_KEY')
+OPENWEATHER_URL = os.getenv('OPENWEATHER_URL', 'http://api.openweathermap.org')
+OPEN_METEO_URL = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com')
+OPEN_METEO_GEOCODING_URL = os.getenv('OPEN_METEO_GEOCODING_URL', 'https://geocoding-api.open-meteo.com')
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '10'))
+# When set, upstream responses and weather view hits are appended to this file for offline replay
+# (weather.replay, `manage.py replay_upstream` and `manage.py replay_day`).
+UPSTREAM_RECORD_PATH = os.getenv('UPSTREAM_RECORD_PATH', '')
+
+# Memory-mapped City lookup table shared by the web workers (weather.snapshot). Disabled in tests.
+CITY_SNAPSHOT_PATH = os.getenv('CITY_SNAPSHOT_PATH', '' if TESTING else os.path.join(tempfile.gettempdir(), 'dwr_city_snapshot.bin'))
+
+# Profiling (DjangoWeatherReminder.profiling): logs query count and time, upstream HTTP time and wall
+# time of every request and Celery task, plus cProfile output for a sample of the slow ones.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0.1'))
+PROFILING_SLOW_MS = float(os.getenv('PROFILING_SLOW_MS', '500'))
+
+# Live weather push (weather.live): Redis pub/sub between processes, in-process for tests.
+LIVE_WEATHER_BROKER = os.getenv('LIVE_WEATHER_BROKER', 'memory' if TESTING else 'redis')
+
+# Celery Configuration Options
+
 CELERY_TIMEZONE = 'UTC'
 CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
 CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
@@ -213,9 +294,27 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 
+# Queue topology and routes live in DjangoWeatherReminder/celery.py. Concurrency and
+# prefetch are read per worker group, so each queue's workers can be sized separately.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_CONCURRENCY = int(os.getenv('CELERY_WORKER_CONCURRENCY', '4'))
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', '1'))
+# Pool processes are forked from the worker after it imported the tasks, so recycling one is cheap.
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.getenv('CELERY_WORKER_MAX_TASKS_PER_CHILD', '1000'))
+
+# Queues the per-city notification work is spread over by consistent hashing of the city id, e.g.
+# "notify-0,notify-1,notify-2". Empty keeps it on the weather queue. Appending a queue only moves the
+# cities it takes over; check the effect first with `manage.py shard_plan`.
+NOTIFICATION_SHARDS = [queue for queue in os.getenv('NOTIFICATION_SHARDS', '').split(',') if queue]
+
 CELERY_BEAT_SCHEDULE = {
     'check-subscriptions-every-5-mins': {
         'task': 'users.tasks.check_due_subscriptions',
         'schedule': 300.0,
     },
+    'refresh-forecasts-every-3-hours': {
+        'task': 'weather.tasks.refresh_subscribed_forecasts',
+        'schedule': 10800.0,
+    },
 }
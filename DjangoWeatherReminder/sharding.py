@@ -0,0 +1,66 @@
+import hashlib
+from bisect import bisect
+
+from django.conf import settings
+
+from DjangoWeatherReminder.celery import TASK_ROUTES
+
+SHARD_REPLICAS = 64
+SHARDED_TASKS = {'users.tasks.send_city_notifications'}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes.
+
+    Every node is placed SHARD_REPLICAS times on the ring, so keys spread evenly and adding a node
+    only moves the keys it takes over; no key moves between the existing nodes.
+    """
+
+    def __init__(self, nodes: list[str], replicas: int = SHARD_REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key) -> str:
+        index = bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+_ring = None
+
+
+def notification_ring() -> HashRing | None:
+    """Returns the ring of the NOTIFICATION_SHARDS queues, or None when sharding is disabled."""
+    global _ring
+    shards = settings.NOTIFICATION_SHARDS
+    if not shards:
+        return None
+    if _ring is None or _ring.nodes != shards:
+        _ring = HashRing(shards)
+    return _ring
+
+
+def shard_queue(city_id: int) -> str | None:
+    """Returns the queue of the shard owning a city, or None when sharding is disabled."""
+    ring = notification_ring()
+    return ring.node_for(city_id) if ring else None
+
+
+def route_notification(name, args, kwargs, options, task=None, **kw):
+    """
+    Celery router sending the notification work of a city to the queue of its shard.
+
+    The city is the first argument of the sharded tasks. Other tasks, and every task while
+    NOTIFICATION_SHARDS is empty, fall through to the static routes. Celery stops at the first
+    matching router, so the rest of the task's static route (its priority) is carried over.
+    """
+    if name not in SHARDED_TASKS or not args:
+        return None
+    queue = shard_queue(args[0])
+    return {**TASK_ROUTES.get(name, {}), 'queue': queue, 'routing_key': queue} if queue else None
@@ -0,0 +1,24 @@
+# Gunicorn settings (`gunicorn -c gunicorn.conf.py DjangoWeatherReminder.wsgi:application`).
+# The app is imported once in the master and the workers are forked from it, so starting or
+# recycling a worker (max_requests) costs a fork instead of a full Django import.
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', '3'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+
+def when_ready(server):
+    # Import the URLconf, and with it every view, in the master too.
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers.
+    from django.db import connections
+    connections.close_all()
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from users.models import User, Subscription
+from users.models import User, Subscription, NotificationDelivery
 
 admin.site.register(User)
 admin.site.register(Subscription)
+admin.site.register(NotificationDelivery)
@@ -0,0 +1,50 @@
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+
+BASIC_AUTH_CACHE_SECONDS = 60
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    BasicAuthentication that remembers a successful password check for a short time.
+
+    The cache key is an HMAC of the credentials keyed with SECRET_KEY, so neither the password nor an
+    unkeyed hash of it reaches the cache. The entry stores the user id and the session auth hash (an HMAC
+    of the password hash) that was verified: the user is still loaded by primary key, so a password
+    change or deactivation takes effect on the next request instead of after the cache expires.
+    """
+
+    def cache_key(self, userid: str, password: str) -> str:
+        digest = hmac.new(settings.SECRET_KEY.encode(), f"{userid}\0{password}".encode(), hashlib.sha256)
+        return f"basicauth:{digest.hexdigest()}"
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = self.cache_key(userid, password)
+        cached = cache.get(key)
+        if cached:
+            user_id, auth_hash = cached
+            user = get_user_model().objects.filter(pk=user_id).first()
+            if user and user.is_active and constant_time_compare(user.get_session_auth_hash(), auth_hash):
+                return (user, None)
+            cache.delete(key)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, user.get_session_auth_hash()), BASIC_AUTH_CACHE_SECONDS)
+        return (user, auth)
+
+
+# For read-only endpoints: the JWT user is built from the token claims without a database lookup, so
+# `request.user` is a TokenUser carrying only the id. Views using these classes must filter by
+# `request.user.id` rather than pass the user object to the ORM.
+STATELESS_AUTHENTICATION_CLASSES = [
+    JWTStatelessUserAuthentication,
+    CachedBasicAuthentication,
+    SessionAuthentication,
+]
@@ -0,0 +1,44 @@
+import base64
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.authentication import CachedBasicAuthentication
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Measures authenticated requests/sec for each authentication class. Nothing is written to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per authentication class.")
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        factory = APIRequestFactory()
+
+        with transaction.atomic():
+            user = User.objects.create_user(username='bench-auth', email='bench-auth@example.com', password='Bench-pass-123')
+            basic = 'Basic ' + base64.b64encode(b'bench-auth:Bench-pass-123').decode()
+            bearer = f'Bearer {AccessToken.for_user(user)}'
+            cases = [
+                ('BasicAuthentication', BasicAuthentication(), basic),
+                ('CachedBasicAuthentication', CachedBasicAuthentication(), basic),
+                ('JWTAuthentication', JWTAuthentication(), bearer),
+                ('JWTStatelessUserAuthentication', JWTStatelessUserAuthentication(), bearer),
+            ]
+            cache.delete(CachedBasicAuthentication().cache_key('bench-auth', 'Bench-pass-123'))
+            for name, authenticator, header in cases:
+                started = time.perf_counter()
+                for _ in range(total):
+                    request = factory.get('/api/subscription/', HTTP_AUTHORIZATION=header)
+                    assert authenticator.authenticate(request) is not None
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{name:<32} {total / elapsed:>10.1f} req/s  {elapsed / total * 1000:>8.3f} ms/req")
+            transaction.set_rollback(True)
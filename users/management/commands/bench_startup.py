@@ -0,0 +1,71 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# What a fresh process imports before it can serve: a gunicorn worker without preloading, and a
+# Celery pool process (Django setup, checks unless CELERY_SKIP_CHECKS, task modules).
+SCENARIOS = {
+    'web': (
+        "from DjangoWeatherReminder.wsgi import application\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns"
+    ),
+    'worker': (
+        "from DjangoWeatherReminder.celery import app\n"
+        "app.loader.import_default_modules()"
+    ),
+}
+
+
+def parse_importtime(stderr: str) -> list[tuple[int, str]]:
+    """Returns (cumulative microseconds, module) of the top-level imports in `python -X importtime` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        if not name.startswith('  '):
+            imports.append((int(cumulative), name.strip()))
+    return imports
+
+
+class Command(BaseCommand):
+    help = "Measures the cold start of web and worker processes and the imports that dominate it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Any of {', '.join(SCENARIOS)} (default: all).")
+        parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters started per scenario.")
+        parser.add_argument('--top', type=int, default=10, help="Slowest top-level imports to list.")
+        parser.add_argument('--budget-ms', type=float, help="Fail when a scenario's median start exceeds this.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        over_budget = []
+        for scenario in options['scenarios'] or SCENARIOS:
+            timings = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', SCENARIOS[scenario]],
+                    env=os.environ.copy(), capture_output=True, text=True,
+                )
+                timings.append((time.perf_counter() - started) * 1000)
+                if result.returncode:
+                    raise CommandError(f"{scenario} failed to start:\n{result.stderr[-2000:]}")
+
+            median = statistics.median(timings)
+            self.stdout.write(f"{scenario}: median {median:.0f} ms, min {min(timings):.0f} ms over {len(timings)} runs")
+            for cumulative, name in sorted(parse_importtime(result.stderr), reverse=True)[:options['top']]:
+                self.stdout.write(f"  {cumulative / 1000:8.1f} ms  {name}")
+            if options['budget_ms'] and median > options['budget_ms']:
+                over_budget.append(f"{scenario} ({median:.0f} ms)")
+
+        if over_budget:
+            raise CommandError(f"Over the {options['budget_ms']:.0f} ms startup budget: {', '.join(over_budget)}")
@@ -0,0 +1,183 @@
+import datetime
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from DjangoWeatherReminder.celery import app
+from users.management.commands.replay_upstream import add_stub_arguments, stub_server
+from users.models import Subscription, User
+from users.shard_cache import shard_cache
+from users.tasks import send_city_notifications
+from weather.live import InProcessBroker
+from weather.services import WeatherRecordBuffer
+from weather.views import CityWeatherByNameView
+
+# Modules whose cache expiries follow the replayed clock instead of the wall clock.
+CLOCK_MODULES = [
+    'django.core.cache.backends.base', 'django.core.cache.backends.locmem', 'weather.services', 'users.shard_cache',
+]
+
+
+class ReplayClock:
+    """Stands in for the `time` module of CLOCK_MODULES during a replay."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def check_interval() -> float:
+    """Seconds between two runs of check_due_subscriptions in the beat schedule."""
+    for entry in settings.CELERY_BEAT_SCHEDULE.values():
+        if entry['task'] == 'users.tasks.check_due_subscriptions':
+            return entry['schedule']
+    return 300.0
+
+
+def due_slots(start: float, end: float) -> list[tuple[float, int, int]]:
+    """
+    Returns (timestamp, city ID, subscription ID) of every slot the current subscriptions are due for
+    between `start` and `end`, starting from each subscription's next_send_at.
+    """
+    slots = []
+    subscriptions = Subscription.objects.values_list('id', 'city_id', 'next_send_at', 'period_push')
+    for sub_id, city_id, next_send_at, period_push in subscriptions:
+        period = max(period_push, 1) * 3600
+        at = start + ((next_send_at.timestamp() if next_send_at else start) - start) % period
+        while at < end:
+            slots.append((at, city_id, sub_id))
+            at += period
+    return sorted(slots)
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))] if samples else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a recorded day of weather view hits, plus the notifications the current subscriptions are due "
+        "for, against the real views and Celery tasks with upstream answered by the replay stub. Reports "
+        "upstream calls saved, view latency and sends/sec. Nothing is written to the database."
+    )
+
+    def add_arguments(self, parser):
+        add_stub_arguments(parser)
+        parser.add_argument('--hours', type=float, default=24, help="Length of the replayed window.")
+        parser.add_argument('--tick', type=float, default=check_interval(),
+                            help="Seconds between notification checks (default: the beat schedule).")
+
+    def handle(self, *args, **options):
+        stub = stub_server(options)
+        recording = stub.recording
+        start = recording.hits[0][0] if recording.hits else time.time()
+        end = start + options['hours'] * 3600
+        hits = [hit for hit in recording.hits if hit[0] < end]
+        clock = ReplayClock(start)
+        # WeatherRecord timestamps follow the wall clock, so writes are held back until the replay is over.
+        buffer = WeatherRecordBuffer(flush_seconds=options['hours'] * 3600, batch_size=sys.maxsize)
+
+        with ExitStack() as stack:
+            stack.enter_context(stub)
+            stack.enter_context(override_settings(
+                OPENWEATHER_URL=stub.url, OPEN_METEO_URL=stub.url, OPEN_METEO_GEOCODING_URL=stub.url,
+                EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'replay'}},
+                CITY_SNAPSHOT_PATH='', UPSTREAM_RECORD_PATH='',
+            ))
+            for module in CLOCK_MODULES:
+                stack.enter_context(patch(f'{module}.time', clock))
+            stack.enter_context(patch('weather.services.weather_buffer', buffer))
+            stack.enter_context(patch('weather.services.get_broker', return_value=InProcessBroker()))
+            stack.callback(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+            app.conf.task_always_eager = True
+            # The replay cache is kept by LocMemCache between runs of the same process.
+            cache.clear()
+            shard_cache.clear()
+            stack.callback(shard_cache.clear)
+            mail.outbox = []
+
+            with transaction.atomic():
+                report = self.replay(hits, due_slots(start, end), end, options['tick'], clock, stub)
+                buffer.flush()
+                transaction.set_rollback(True)
+        self.stdout.write(report)
+
+    def replay(self, hits, slots, end, tick, clock, stub) -> str:
+        if not hits and not slots:
+            raise CommandError("Nothing to replay: the recording has no weather hits and no subscription is due.")
+        Subscription.objects.exclude(webhook_url=None).exclude(webhook_url='').update(webhook_url=f"{stub.url}/webhook")
+        user = User.objects.create_user(username='replay-day', email='replay-day@example.com')
+        view = CityWeatherByNameView.as_view()
+        factory = APIRequestFactory()
+        due = deque(slots)
+        latencies, statuses = [], Counter()
+        notify_seconds, city_tasks = 0.0, 0
+        next_tick = clock.now
+
+        for at, city_name, country_code in hits + [(end, None, None)]:
+            while next_tick <= at and next_tick < end:
+                clock.now = next_tick
+                by_city = defaultdict(list)
+                while due and due[0][0] <= next_tick:
+                    slot, city_id, sub_id = due.popleft()
+                    by_city[city_id].append([sub_id, datetime.datetime.fromtimestamp(slot, datetime.timezone.utc).isoformat()])
+                started = time.perf_counter()
+                for city_id, subscription_slots in by_city.items():
+                    send_city_notifications.apply(args=(city_id, subscription_slots))
+                notify_seconds += time.perf_counter() - started
+                city_tasks += len(by_city)
+                next_tick += tick
+            if city_name is None:
+                break
+
+            clock.now = at
+            kwargs = {'city_name': city_name, 'country_code': country_code}
+            request = factory.get(reverse('city-weather-by-name', kwargs=kwargs))
+            force_authenticate(request, user)
+            started = time.perf_counter()
+            try:
+                response = view(request, **kwargs)
+                response.render()
+                status = response.status_code
+            except Exception:
+                # Upstream errors surface as django.core.exceptions.ValidationError, which DRF leaves unhandled;
+                # the server would answer them with a 500.
+                status = 500
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+        lookups = len(hits) + city_tasks
+        upstream_calls = stub.upstream_calls()
+        saved = lookups - upstream_calls
+        sends = len(mail.outbox) + stub.calls['POST', '/webhook'] - stub.errors['POST', '/webhook']
+        return "\n".join([
+            f"Replayed {len(hits)} weather hits and {len(slots)} notification slots in {city_tasks} city tasks",
+            f"Upstream calls: {upstream_calls} for {lookups} weather lookups, {saved} saved"
+            f" ({saved / lookups:.1%})" if lookups else "Upstream calls: 0",
+            f"Injected or replayed upstream errors: {sum(stub.errors.values())}",
+            f"Weather view: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms,"
+            f" statuses {dict(sorted(statuses.items()))}",
+            f"Notifications: {sends} sent in {notify_seconds:.2f} s"
+            f" ({sends / notify_seconds if notify_seconds else 0:.1f} sends/s)",
+        ])
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from weather.replay import Recording, ReplayServer
+
+
+def add_stub_arguments(parser):
+    """Options of the replay stub server, shared with `replay_day`."""
+    parser.add_argument('recordings', nargs='+', help="Files recorded with UPSTREAM_RECORD_PATH.")
+    parser.add_argument('--latency-ms', type=float, help="Fixed delay of every answer instead of the recorded one.")
+    parser.add_argument('--latency-scale', type=float, default=1.0, help="Multiplier of the recorded delays.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of answers replaced by HTTP 503.")
+    parser.add_argument('--seed', type=int, help="Seed of the error injection, for repeatable runs.")
+
+
+def stub_server(options, **kwargs) -> ReplayServer:
+    return ReplayServer(
+        Recording(options['recordings']), latency_ms=options['latency_ms'], latency_scale=options['latency_scale'],
+        error_rate=options['error_rate'], seed=options['seed'], **kwargs,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves recorded upstream responses locally. Point OPENWEATHER_URL, OPEN_METEO_URL and "
+        "OPEN_METEO_GEOCODING_URL at it to run without calling the weather providers."
+    )
+
+    def add_arguments(self, parser):
+        add_stub_arguments(parser)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+
+    def handle(self, *args, **options):
+        with stub_server(options, host=options['host'], port=options['port']) as server:
+            recording = server.recording
+            self.stdout.write(
+                f"Replaying {sum(map(len, recording.responses.values()))} responses for "
+                f"{len(recording.by_path)} paths at {server.url} (Ctrl-C to stop)"
+            )
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        for (method, path), count in sorted(server.calls.items()):
+            self.stdout.write(f"{method} {path}: {count} calls, {server.errors[method, path]} errors")
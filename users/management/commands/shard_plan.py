@@ -0,0 +1,37 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from DjangoWeatherReminder.sharding import HashRing
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = "Shows how subscribed cities spread over notification shards, and how many move to reach a new shard list."
+
+    def add_arguments(self, parser):
+        parser.add_argument('shards', nargs='?', help="Comma-separated queues to compare with NOTIFICATION_SHARDS.")
+
+    def handle(self, *args, **options):
+        current = settings.NOTIFICATION_SHARDS
+        proposed = [queue for queue in (options['shards'] or '').split(',') if queue] or current
+        if not proposed:
+            raise CommandError("NOTIFICATION_SHARDS is empty; pass the queues to plan for.")
+
+        subscribers = Counter(Subscription.objects.values_list('city_id', flat=True))
+        new_ring = HashRing(proposed)
+        old_ring = HashRing(current) if current else None
+
+        cities, load, moved = Counter(), Counter(), 0
+        for city_id in subscribers:
+            queue = new_ring.node_for(city_id)
+            cities[queue] += 1
+            load[queue] += subscribers[city_id]
+            if old_ring and old_ring.node_for(city_id) != queue:
+                moved += 1
+
+        for queue in proposed:
+            self.stdout.write(f"{queue}: {cities[queue]} cities, {load[queue]} subscriptions")
+        if old_ring and proposed != current:
+            self.stdout.write(f"{moved} of {len(subscribers)} cities move from {','.join(current)}")
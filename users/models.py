@@ -1,5 +1,6 @@
 import datetime
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 from weather.models import City
@@ -20,10 +21,75 @@ class Subscription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def schedule_next(self):
+    def schedule_next(self, save: bool = True):
         utc_tz = datetime.timezone.utc
         self.next_send_at = datetime.datetime.now(utc_tz) + datetime.timedelta(hours=self.period_push)
-        self.save()
+        if save:
+            self.save()
 
     class Meta:
         unique_together = ('user', 'city')
+
+
+class NotificationDelivery(models.Model):
+    """Ledger entry for one scheduled notification of a subscription, one row per send slot."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENDING = 'sending', 'Sending'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+        SKIPPED = 'skipped', 'Skipped'
+
+    subscription = models.ForeignKey(to=Subscription, on_delete=models.CASCADE, related_name='deliveries')
+    scheduled_slot = models.DateTimeField()
+    email_status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    webhook_status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_done(self) -> bool:
+        return self.email_status != self.Status.PENDING and self.webhook_status != self.Status.PENDING
+
+    @classmethod
+    def mark(cls, delivery_id: int, **statuses):
+        """Records the outcome of a channel without loading the row."""
+        cls.objects.filter(id=delivery_id).update(updated_at=timezone.now(), **statuses)
+
+    @classmethod
+    def claim(cls, delivery_id: int, channel: str) -> bool:
+        """
+        Moves a pending channel to SENDING, so that only one task sends it.
+
+        Args:
+            delivery_id (int): The ID of the ledger entry.
+            channel (str): 'email_status' or 'webhook_status'.
+
+        Returns:
+            bool: True if this caller got the claim.
+        """
+        claimed = cls.objects.filter(id=delivery_id, **{channel: cls.Status.PENDING}).update(
+            updated_at=timezone.now(), **{channel: cls.Status.SENDING}
+        )
+        return claimed == 1
+
+    @classmethod
+    def release_stale_claims(cls, older_than: datetime.timedelta) -> int:
+        """
+        Returns channels stuck in SENDING, e.g. after a worker died mid-send, to PENDING so that the
+        redelivered task can claim them again.
+
+        Returns:
+            int: The number of ledger entries released.
+        """
+        cutoff = timezone.now() - older_than
+        released = 0
+        for channel in ('email_status', 'webhook_status'):
+            released += cls.objects.filter(updated_at__lt=cutoff, **{channel: cls.Status.SENDING}).update(
+                updated_at=timezone.now(), **{channel: cls.Status.PENDING}
+            )
+        return released
+
+    class Meta:
+        unique_together = ('subscription', 'scheduled_slot')
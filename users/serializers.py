@@ -34,3 +34,12 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         model = Subscription
         fields = ['city', 'email_push', 'webhook_url', 'period_push', 'created_at', 'updated_at']
         read_only_fields = ['city', 'created_at', 'updated_at']
+
+
+class SubscriptionBulkEntrySerializer(serializers.ModelSerializer):
+    city = serializers.CharField(max_length=100)
+    country = serializers.CharField(max_length=100)
+
+    class Meta:
+        model = Subscription
+        fields = ['city', 'country', 'email_push', 'webhook_url', 'period_push']
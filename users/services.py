@@ -0,0 +1,130 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from users.models import Subscription
+from weather.models import City
+from weather.services import geocode_city
+from weather.snapshot import current_snapshot, rebuild_city_snapshot
+
+GEOCODE_WORKERS = 8
+
+
+def city_key(name: str, country: str) -> tuple[str, str]:
+    """Normalizes a city name and country code the way `name__iexact`/`country__iexact` compare them."""
+    return name.strip().casefold(), country.strip().casefold()
+
+
+def _geocode(pair: tuple[str, str]) -> dict | str:
+    try:
+        return geocode_city(*pair)
+    except ValidationError as e:
+        return str(e)
+
+
+def resolve_cities(pairs: list[tuple[str, str]]) -> tuple[dict, dict]:
+    """
+    Resolves many (city name, country code) pairs at once.
+
+    Known cities come from the City snapshot, or from a single query for those it lacks. The rest are geocoded concurrently and stored with one
+    upsert, followed by one more query to load them.
+
+    Args:
+        pairs (list): (city name, country code) tuples as given by the client.
+
+    Returns:
+        tuple: ({city_key: City}, {city_key: error message}) for every requested pair.
+    """
+    requested = {city_key(*pair): pair for pair in pairs}
+    if not requested:
+        return {}, {}
+
+    snapshot = current_snapshot()
+    cities = {}
+    if snapshot:
+        for key, pair in requested.items():
+            city = snapshot.lookup(*pair)
+            if city:
+                cities[key] = city
+    query = Q()
+    for key, (name, country) in requested.items():
+        if key not in cities:
+            query |= Q(name__iexact=name, country__iexact=country)
+    if query:
+        cities.update({city_key(city.name, city.country): city for city in City.objects.filter(query)})
+
+    misses = [key for key in requested if key not in cities]
+    errors = {}
+    if misses:
+        with ThreadPoolExecutor(max_workers=min(GEOCODE_WORKERS, len(misses))) as pool:
+            results = dict(zip(misses, pool.map(_geocode, [requested[key] for key in misses])))
+
+        found = {key: data for key, data in results.items() if isinstance(data, dict)}
+        errors = {key: data for key, data in results.items() if not isinstance(data, dict)}
+        if found:
+            # Aliases such as "Kiev" and "Kyiv" geocode to the same city, which may appear only once in the upsert.
+            unique = {(data["name"], data["country"]): data for data in found.values()}
+            City.objects.bulk_create(
+                [City(name=name, country=country, lat=data["lat"], lon=data["lon"])
+                 for (name, country), data in unique.items()],
+                update_conflicts=True,
+                unique_fields=['name', 'country'],
+                update_fields=['lat', 'lon'],
+            )
+            geocoded = Q()
+            for name, country in unique:
+                geocoded |= Q(name=name, country=country)
+            stored = {(city.name, city.country): city for city in City.objects.filter(geocoded)}
+            for key, data in found.items():
+                cities[key] = stored[(data["name"], data["country"])]
+            transaction.on_commit(rebuild_city_snapshot)
+
+    return {key: cities[key] for key in requested if key in cities}, errors
+
+
+def bulk_subscribe(user_id: int, entries: list[dict]) -> tuple[list[Subscription], list[dict]]:
+    """
+    Creates or updates a user's subscriptions for many cities in one upsert.
+
+    Args:
+        user_id (int): The subscribing user.
+        entries (list): Validated entries with city, country, email_push, webhook_url and period_push.
+            Later entries for the same city win.
+
+    Returns:
+        tuple: (the stored subscriptions with their cities, the entries that could not be resolved
+        with an ``error`` message).
+    """
+    cities, errors = resolve_cities([(entry["city"], entry["country"]) for entry in entries])
+
+    utc_tz = datetime.timezone.utc
+    now = datetime.datetime.now(utc_tz)
+    subscriptions = {}
+    failed = []
+    for entry in entries:
+        key = city_key(entry["city"], entry["country"])
+        city = cities.get(key)
+        if city is None:
+            failed.append({"city": entry["city"], "country": entry["country"], "error": errors.get(key)})
+            continue
+        period_push = entry.get("period_push", 12)
+        subscriptions[city.id] = Subscription(
+            user_id=user_id,
+            city=city,
+            email_push=entry.get("email_push", True),
+            webhook_url=entry.get("webhook_url", None),
+            period_push=period_push,
+            next_send_at=now + datetime.timedelta(hours=period_push),
+        )
+
+    Subscription.objects.bulk_create(
+        subscriptions.values(),
+        update_conflicts=True,
+        unique_fields=['user', 'city'],
+        update_fields=['email_push', 'webhook_url', 'period_push', 'next_send_at', 'updated_at'],
+    )
+    stored = Subscription.objects.select_related('city').filter(user_id=user_id, city_id__in=subscriptions)
+    return list(stored.order_by('id')), failed
@@ -0,0 +1,132 @@
+import os
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import cache
+
+from users.models import Subscription
+from weather.models import City
+
+SHARD_WEATHER_SECONDS = 120
+SHARD_SUBSCRIBERS_SECONDS = 300
+# Cities kept in each part of the cache; the entries stored longest ago are dropped first.
+SHARD_CACHE_MAX_CITIES = 5000
+STATS_PUBLISH_SECONDS = 30
+
+
+def stats_key(hostname: str, pid: int) -> str:
+    return f"shardcache:{hostname}:{pid}"
+
+
+class ShardCache:
+    """
+    In-process cache of the weather and subscriber lists of the cities a worker handles.
+
+    With NOTIFICATION_SHARDS each worker group only sees the cities of its shard, so the entries stay hot
+    and the hit rate grows with the number of shards. Cached subscriptions are checked against their
+    `updated_at` on every use, so edits and deletions are picked up right away; only the user's name and
+    email may lag by up to SHARD_SUBSCRIBERS_SECONDS.
+
+    Entries are kept in the order they were stored, which is also the order they expire in, so expired
+    entries are pruned from the front on every store and at most `max_cities` cities are held per part.
+    """
+
+    def __init__(self, max_cities: int = SHARD_CACHE_MAX_CITIES):
+        self.max_cities = max_cities
+        self._weather = OrderedDict()
+        self._subscriptions = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+        self._published_at = 0.0
+
+    def weather(self, city: City, load) -> dict | None:
+        """
+        Returns the weather of a city, calling `load(city)` when no fresh copy is held.
+
+        Args:
+            city (City): The city.
+            load (callable): Fetches the weather result of the city.
+        """
+        expires, result = self._weather.get(city.id, (0, None))
+        if expires > time.monotonic():
+            self.hits['weather'] += 1
+            return result
+        self.misses['weather'] += 1
+        result = load(city)
+        if result:
+            self._store(self._weather, city.id, SHARD_WEATHER_SECONDS, result)
+        return result
+
+    def subscriptions(self, city_id: int, subscription_ids) -> list[Subscription]:
+        """
+        Returns the given subscriptions of a city, with city and user loaded.
+
+        Subscriptions that no longer exist or moved to another city are left out.
+        """
+        versions = dict(
+            Subscription.objects.filter(id__in=subscription_ids, city_id=city_id).values_list('id', 'updated_at')
+        )
+        expires, cached = self._subscriptions.get(city_id, (0, {}))
+        fresh = expires > time.monotonic() and all(
+            sub_id in cached and cached[sub_id].updated_at == updated_at for sub_id, updated_at in versions.items()
+        )
+        if fresh:
+            self.hits['subscribers'] += 1
+        else:
+            self.misses['subscribers'] += 1
+            cached = {sub.id: sub for sub in Subscription.objects.select_related('city', 'user').filter(city_id=city_id)}
+            self._store(self._subscriptions, city_id, SHARD_SUBSCRIBERS_SECONDS, cached)
+        return [cached[sub_id] for sub_id in versions if sub_id in cached]
+
+    def _store(self, entries: OrderedDict, city_id: int, seconds: int, value):
+        now = time.monotonic()
+        entries.pop(city_id, None)
+        entries[city_id] = (now + seconds, value)
+        while entries:
+            expires, _ = next(iter(entries.values()))
+            if expires > now and len(entries) <= self.max_cities:
+                break
+            entries.popitem(last=False)
+
+    def clear(self):
+        self._weather.clear()
+        self._subscriptions.clear()
+        self.hits.clear()
+        self.misses.clear()
+        self._published_at = 0.0
+
+    def stats(self) -> dict:
+        """Hit rate and size of each part of the cache."""
+        stats = {}
+        for kind, entries in (('weather', self._weather), ('subscribers', self._subscriptions)):
+            lookups = self.hits[kind] + self.misses[kind]
+            stats[kind] = {
+                'cities': len(entries),
+                'hits': self.hits[kind],
+                'misses': self.misses[kind],
+                'hit_rate': round(self.hits[kind] / lookups, 3) if lookups else None,
+            }
+        return stats
+
+    def publish_stats(self, hostname: str):
+        """Shares the stats of this process through the cache, at most every STATS_PUBLISH_SECONDS."""
+        now = time.monotonic()
+        if now - self._published_at >= STATS_PUBLISH_SECONDS:
+            self._published_at = now
+            cache.set(stats_key(hostname, os.getpid()), self.stats(), STATS_PUBLISH_SECONDS * 10)
+
+
+shard_cache = ShardCache()
+
+
+def shard_cache_stats(state):
+    """
+    Remote control command: ``celery -A DjangoWeatherReminder inspect shard_cache_stats``.
+    It is registered by the worker at startup (DjangoWeatherReminder/celery.py).
+
+    Control commands run in the worker's main process while the caches live in the pool processes,
+    so the stats they published are collected by pid.
+    """
+    pids = state.consumer.pool.info.get('processes') or [os.getpid()]
+    published = cache.get_many([stats_key(state.consumer.hostname, pid) for pid in pids])
+    return {key.rsplit(':', 1)[1]: stats for key, stats in published.items()}
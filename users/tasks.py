@@ -1,67 +1,239 @@
 import datetime
 import requests
+from collections import defaultdict
 
 from celery import shared_task
 from contextlib import contextmanager
 from django.core.mail import send_mail
-from django.core.cache import cache
 
-from users.models import Subscription
-from weather.services import weather_city
+from DjangoWeatherReminder.locks import CacheLock, LOCK_EXPIRE
+from DjangoWeatherReminder.profiling import upstream
+from users.models import Subscription, NotificationDelivery
+from users.shard_cache import shard_cache
+from weather.services import cached_weather, weather_city
 
-LOCK_EXPIRE = 60
+WEBHOOK_TIMEOUT = 10
+# A city task finding the city locked by another one waits for it instead of dropping its slots, which
+# nothing else would queue again; the retries cover twice the lock's expiry.
+CITY_LOCK_RETRY_SECONDS = 10
+CITY_LOCK_MAX_RETRIES = 2 * LOCK_EXPIRE // CITY_LOCK_RETRY_SECONDS
+# A channel still SENDING after this long belongs to a task that died; it is handed back for redelivery.
+CLAIM_TIMEOUT = datetime.timedelta(minutes=15)
+
+Status = NotificationDelivery.Status
+
+
+def city_weather(city) -> dict | None:
+    """The cached weather of a city, fetched from the providers when the cache has none."""
+    return cached_weather(city) or weather_city(city)
 
 
 @contextmanager
 def task_lock(lock_id, expire=LOCK_EXPIRE):
-    acquired = cache.add(lock_id, True, expire)
+    lock = CacheLock(lock_id, expire)
+    lock.acquire()
     try:
-        yield acquired
+        yield lock
     finally:
-        if acquired:
-            cache.delete(lock_id)
+        lock.release()
+
+
+def dispatch_notification(subscription: Subscription, delivery: NotificationDelivery, weather: dict, slot):
+    """
+    Enqueues the channels of a delivery that are still pending and moves the subscription to its next slot.
+
+    Args:
+        subscription (Subscription): The subscription, with city and user loaded.
+        delivery (NotificationDelivery): The ledger entry for this slot.
+        weather (dict): The weather result to send.
+        slot (datetime): The slot being delivered.
+    """
+    city = subscription.city
+    user = subscription.user
+
+    skipped = {}
+    if not subscription.email_push:
+        skipped['email_status'] = Status.SKIPPED
+    elif delivery.email_status == Status.PENDING:
+        send_email_notification.delay(
+            delivery.id,
+            recipient=user.email,
+            subject=f"Weather in: {city.name}",
+            message=f"Hello {user.username},\nCurrent weather in: {city.name}:\nTemperature: {weather['temperature']}°C\nFeels like: {weather['feels_like']}\nHumidity: {weather['humidity']}%",
+        )
+
+    if not subscription.webhook_url:
+        skipped['webhook_status'] = Status.SKIPPED
+    elif delivery.webhook_status == Status.PENDING:
+        send_webhook_notification.delay(delivery.id, subscription.webhook_url, weather)
+    if skipped:
+        NotificationDelivery.mark(delivery.id, **skipped)
+
+    # Only the first run for a slot moves the subscription forward.
+    utc_tz = datetime.timezone.utc
+    next_send_at = datetime.datetime.now(utc_tz) + datetime.timedelta(hours=subscription.period_push)
+    Subscription.objects.filter(id=subscription.id, next_send_at=slot).update(next_send_at=next_send_at)
 
 
 @shared_task
-def send_weather_notification(subscription_id):
+def send_weather_notification(subscription_id, scheduled_slot=None):
     """
-    Sends a weather notification to the user for a specific subscription.
+    Fetches the weather for a subscription and hands the delivery over to the email and webhook queues.
+
+    Every send is recorded in the NotificationDelivery ledger under its scheduled slot, so a redelivered
+    task only finishes the channels that are still pending.
 
     Args:
         subscription_id (int): The ID of the Subscription object.
+        scheduled_slot (str | None): ISO timestamp of the slot being delivered. Defaults to the
+            subscription's current next_send_at.
     """
     lock_id = f"sublock-{subscription_id}"
 
-    with task_lock(lock_id) as acquired:
-        if not acquired:
+    with task_lock(lock_id) as lock:
+        if not lock.acquired:
+            return None
+        subscription = Subscription.objects.select_related('city', 'user').get(id=subscription_id)
+
+        utc_tz = datetime.timezone.utc
+        if scheduled_slot:
+            slot = datetime.datetime.fromisoformat(scheduled_slot)
+        else:
+            slot = subscription.next_send_at or datetime.datetime.now(utc_tz)
+        delivery, _ = NotificationDelivery.objects.get_or_create(subscription=subscription, scheduled_slot=slot)
+        if delivery.is_done:
+            return None
+
+        weather = weather_city(subscription.city)
+        if not weather or not lock.renew():
+            return None
+        dispatch_notification(subscription, delivery, weather, slot)
+
+
+@shared_task(bind=True, max_retries=CITY_LOCK_MAX_RETRIES)
+def send_city_notifications(self, city_id, subscription_slots):
+    """
+    Delivers one slot of several subscriptions of the same city with a single weather fetch.
+
+    With NOTIFICATION_SHARDS the task is routed to the queue owning the city, and the weather and
+    subscribers come from the worker's shard cache. While another task holds the city, this one is
+    retried after CITY_LOCK_RETRY_SECONDS.
+
+    Args:
+        city_id (int): The ID of the City shared by the subscriptions.
+        subscription_slots (list): [subscription ID, ISO timestamp of the slot] pairs.
+    """
+    lock_id = f"citylock-{city_id}"
+
+    with task_lock(lock_id) as lock:
+        if not lock.acquired:
+            raise self.retry(countdown=CITY_LOCK_RETRY_SECONDS)
+        slots = {sub_id: datetime.datetime.fromisoformat(slot) for sub_id, slot in subscription_slots}
+        subscriptions = shard_cache.subscriptions(city_id, slots)
+        if not subscriptions:
+            return None
+
+        NotificationDelivery.objects.bulk_create(
+            [NotificationDelivery(subscription_id=sub.id, scheduled_slot=slots[sub.id]) for sub in subscriptions],
+            ignore_conflicts=True,
+        )
+        deliveries = {
+            delivery.subscription_id: delivery
+            for delivery in NotificationDelivery.objects.filter(subscription_id__in=slots, scheduled_slot__in=slots.values())
+            if delivery.scheduled_slot == slots[delivery.subscription_id]
+        }
+        pending = [sub for sub in subscriptions if not deliveries[sub.id].is_done]
+        if not pending:
+            return None
+
+        weather = shard_cache.weather(pending[0].city, city_weather)
+        if not weather or not lock.renew():
             return None
-        subscription = Subscription.objects.get(id=subscription_id)
-        city = subscription.city
-        user = subscription.user
+        for subscription in pending:
+            dispatch_notification(subscription, deliveries[subscription.id], weather, slots[subscription.id])
+    if self.request.hostname:
+        shard_cache.publish_stats(self.request.hostname)
+
+
+@shared_task(bind=True, max_retries=3)
+def send_email_notification(self, delivery_id, recipient, subject, message):
+    """
+    Sends a prepared weather email if this task can claim it in the ledger.
+
+    The channel is claimed with a conditional update, so of several tasks for the same slot only one sends.
+    A failed attempt hands the claim back before retrying; the channel is FAILED once the retries are used up.
 
-        weather = weather_city(city)
-        if not weather:
+    Args:
+        delivery_id (int): The ID of the NotificationDelivery entry.
+        recipient (str): The email address of the user.
+        subject (str): The email subject.
+        message (str): The email body.
+    """
+    if not NotificationDelivery.claim(delivery_id, 'email_status'):
+        return None
+    try:
+        send_mail(
+            subject=subject,
+            message=message,
+            from_email=None,
+            recipient_list=[recipient],
+        )
+    except OSError as exc:  # smtplib.SMTPException and connection errors
+        if self.request.retries >= self.max_retries:
+            NotificationDelivery.mark(delivery_id, email_status=Status.FAILED)
             return None
+        NotificationDelivery.mark(delivery_id, email_status=Status.PENDING)
+        raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+    NotificationDelivery.mark(delivery_id, email_status=Status.SENT)
+
 
-        if subscription.email_push:
-            send_mail(
-                subject=f"Weather in: {city.name}",
-                message=f"Hello {user.username},\nCurrent weather in: {city.name}:\nTemperature: {weather['temperature']}°C\nFeels like: {weather['feels_like']}\nHumidity: {weather['humidity']}%",
-                from_email=None,
-                recipient_list=[user.email],
-            )
+@shared_task(bind=True, max_retries=3)
+def send_webhook_notification(self, delivery_id, webhook_url, payload):
+    """
+    Posts the weather payload to a subscription webhook if this task can claim it in the ledger.
+
+    A failed attempt hands the claim back before retrying.
 
-        if hasattr(subscription, 'webhook_url') and subscription.webhook_url:
-            requests.post(subscription.webhook_url, json=weather)
-        subscription.schedule_next()
+    Args:
+        delivery_id (int): The ID of the NotificationDelivery entry.
+        webhook_url (str): The URL to post to.
+        payload (dict): The weather data.
+    """
+    if not NotificationDelivery.claim(delivery_id, 'webhook_status'):
+        return None
+    try:
+        with upstream():
+            response = requests.post(webhook_url, json=payload, timeout=WEBHOOK_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as exc:
+        if self.request.retries >= self.max_retries:
+            NotificationDelivery.mark(delivery_id, webhook_status=Status.FAILED)
+            return None
+        NotificationDelivery.mark(delivery_id, webhook_status=Status.PENDING)
+        raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+    NotificationDelivery.mark(delivery_id, webhook_status=Status.SENT)
 
 
 @shared_task
 def check_due_subscriptions():
-    """Checks all subscriptions that are due for notification and triggers their tasks."""
+    """
+    Checks all subscriptions that are due for notification and triggers one task per city.
+
+    Ledger rows for the due slots are inserted in one batch; slots that are already in the ledger
+    are left untouched, so overlapping runs don't produce duplicate sends. Stale SENDING claims are
+    released first.
+    """
+    NotificationDelivery.release_stale_claims(CLAIM_TIMEOUT)
     utc_tz = datetime.timezone.utc
     now = datetime.datetime.now(utc_tz)
-    due_subs = Subscription.objects.filter(next_send_at__lte=now)
+    due_subs = list(Subscription.objects.filter(next_send_at__lte=now).values_list('id', 'city_id', 'next_send_at'))
 
-    for sub in due_subs:
-        send_weather_notification.delay(sub.id)
+    NotificationDelivery.objects.bulk_create(
+        [NotificationDelivery(subscription_id=sub_id, scheduled_slot=slot) for sub_id, _, slot in due_subs],
+        ignore_conflicts=True,
+    )
+    by_city = defaultdict(list)
+    for sub_id, city_id, slot in due_subs:
+        by_city[city_id].append([sub_id, slot.isoformat()])
+    for city_id, subscription_slots in by_city.items():
+        send_city_notifications.delay(city_id, subscription_slots)
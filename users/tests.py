@@ -1,11 +1,34 @@
-from unittest.mock import patch
+import datetime
+from unittest.mock import patch, MagicMock
+import base64
+import json
+import os
+import smtplib
+import threading
 from django.core import mail
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase, override_settings
 from django.urls import reverse
+import fakeredis
+import requests
+from celery.exceptions import Retry
 from rest_framework.test import APITestCase
 
-from users.models import User, Subscription
-from users.tasks import send_weather_notification
+from users.authentication import CachedBasicAuthentication
+from users.models import User, Subscription, NotificationDelivery
+from users.shard_cache import SHARD_WEATHER_SECONDS, ShardCache, shard_cache, shard_cache_stats
+from DjangoWeatherReminder.locks import CacheLock
+from DjangoWeatherReminder.profiling import profile, query_budget
+from DjangoWeatherReminder.sharding import HashRing, shard_queue
+from DjangoWeatherReminder.celery import app, EMAIL_QUEUE, PRIORITY_NORMAL, WEATHER_QUEUE, WEBHOOK_QUEUE
+from users.tasks import (
+    CITY_LOCK_RETRY_SECONDS, check_due_subscriptions, send_city_notifications, send_weather_notification, send_email_notification,
+    send_webhook_notification
+)
+from users.views import SubscriptionCityView, SubscriptionViewSet
 from weather.models import City
 
 
@@ -72,10 +95,85 @@ class SubscriptionAPITest(APITestCase):
     def test_create_subscription(self, mock_task):
         """User can create a subscription."""
         data = {"email_push": True, "period_push": 3, "webhook_url": "https://test.com"}
-        response = self.client.post(self.sub_url, data)
+        with query_budget(self, SubscriptionCityView.query_budget):
+            response = self.client.post(self.sub_url, data)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["subscription"], True)
 
+    @override_settings(API_KEY="leaky-api-key")
+    @patch("weather.providers.requests.get")
+    def test_upstream_errors_hide_api_key(self, mock_get):
+        """Upstream failures reach the client without the API key from the URL or the upstream body."""
+        def refuse(url, **kwargs):
+            raise requests.ConnectionError(f"Max retries exceeded with url: {url}")
+
+        mock_get.side_effect = refuse
+        url = reverse('city-weather-subscription', kwargs={'city_name': 'Odesa', 'country_code': 'UA'})
+        response = self.client.post(url, {"period_push": 3})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("ConnectionError", response.data["error"])
+        self.assertNotIn("leaky-api-key", response.content.decode())
+
+        mock_get.side_effect = None
+        mock_get.return_value = MagicMock(status_code=401, text='{"message": "Invalid API key leaky-api-key"}')
+        response = self.client.post(reverse('subscription-bulk'), [{"city": "Odesa", "country": "UA"}], format='json')
+        self.assertIn("HTTP 401", response.data["errors"][0]["error"])
+        self.assertNotIn("leaky-api-key", response.content.decode())
+
+    @patch("users.views.find_city")
+    @patch("users.views.send_weather_notification.delay")
+    def test_subscribe_matches_city_case_insensitively(self, mock_task, mock_find_city):
+        """A known city is found whatever the case of its name and country code, without geocoding."""
+        url = reverse('city-weather-subscription', kwargs={'city_name': 'kyiv', 'country_code': 'ua'})
+        response = self.client.post(url, {"period_push": 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Subscription.objects.get(user=self.user).city, self.city)
+        mock_find_city.assert_not_called()
+
+    def test_list_subscriptions_within_budget(self):
+        """Listing does not query the city of each subscription separately."""
+        for i in range(5):
+            city = City.objects.create(name=f"City{i}", country="UA", lat=50, lon=30)
+            Subscription.objects.create(user=self.user, city=city)
+        with query_budget(self, SubscriptionViewSet.query_budget):
+            response = self.client.get(reverse('subscription-list'))
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(response.data[0]["city"]["name"], "City0")
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_MS=0)
+    def test_profiling_middleware(self):
+        """Profiled requests report their timings and are logged with their view name."""
+        client = self.client_class()
+        client.credentials(**self.client._credentials)
+        with self.assertLogs('DjangoWeatherReminder.profiling', level='INFO') as logs:
+            response = client.get(reverse('subscription-list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertTrue(logs.output[0].startswith('INFO:DjangoWeatherReminder.profiling:GET subscription-list'))
+        self.assertIn('Slow GET subscription-list profile', logs.output[1])
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_MS=0)
+    def test_one_sampled_profile_per_process(self):
+        """A request overlapping a sampled one is profiled without cProfile instead of failing."""
+        started, done = threading.Event(), threading.Event()
+
+        def first_request():
+            with profile("GET first"):
+                started.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=first_request)
+        with self.assertLogs('DjangoWeatherReminder.profiling', level='INFO') as logs:
+            thread.start()
+            started.wait(5)
+            with profile("GET second"):
+                pass
+            done.set()
+            thread.join()
+        slow = [line for line in logs.output if 'profile:' in line]
+        self.assertEqual(len(slow), 1)
+        self.assertIn('Slow GET first profile', slow[0])
+
     def test_list_subscriptions(self):
         """User can retrieve a list of their subscriptions."""
         Subscription.objects.create(
@@ -90,6 +188,19 @@ class SubscriptionAPITest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data[0]["webhook_url"], "https://test.com")
 
+    def test_export_subscriptions(self):
+        """Only the user's own subscriptions are exported."""
+        other = User.objects.create_user(username='Petro', email='petro@test.com', password='Bt41BBT103')
+        lviv = City.objects.create(name="Lviv", country="UA", lat=49.84, lon=24.03)
+        Subscription.objects.create(user=self.user, city=self.city, period_push=3)
+        Subscription.objects.create(user=other, city=lviv, period_push=6)
+        response = self.client.get(reverse('export-subscriptions'))
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["city_name"], "Kyiv")
+        self.assertEqual(rows[0]["period_push"], 3)
+
     @patch("users.views.send_weather_notification.delay")
     def test_update_subscription(self, mock_task):
         """User can update subscription settings."""
@@ -118,8 +229,9 @@ class SubscriptionAPITest(APITestCase):
         self.assertEqual(response.data["subscription"], "Subscription removed")
 
     @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    @patch("users.tasks.send_email_notification.delay", side_effect=send_email_notification.run)
     @patch("users.views.send_weather_notification.delay")
-    def test_email_send(self, mock_task):
+    def test_email_send(self, mock_task, mock_email):
         """Test that an email notification is sent when a subscription with email_push=True is created."""
         data = {"email_push": True, "period_push": 3}
         response = self.client.post(self.sub_url, data)
@@ -129,8 +241,9 @@ class SubscriptionAPITest(APITestCase):
         self.assertIn("Kyiv", mail.outbox[0].subject)
 
     @patch("users.tasks.requests.post")
+    @patch("users.tasks.send_webhook_notification.delay", side_effect=send_webhook_notification.run)
     @patch("users.views.send_weather_notification.delay")
-    def test_webhook_send(self, mock_task, mock_post):
+    def test_webhook_send(self, mock_task, mock_webhook, mock_post):
         """Test that webhook URL is stored and called when notification task is executed."""
         data = {
             "email_push": False,
@@ -148,3 +261,368 @@ class SubscriptionAPITest(APITestCase):
         args, kwargs = mock_post.call_args
         self.assertIn("json", kwargs)
         self.assertIn("temperature", kwargs["json"])
+
+
+class TaskRoutingTest(TestCase):
+    """Tests for the Celery queue topology."""
+
+    def test_tasks_are_routed_to_their_queues(self):
+        """Fetch, email and webhook work each go to a dedicated queue."""
+        routes = {
+            'users.tasks.check_due_subscriptions': WEATHER_QUEUE,
+            'users.tasks.send_weather_notification': WEATHER_QUEUE,
+            'users.tasks.send_email_notification': EMAIL_QUEUE,
+            'users.tasks.send_webhook_notification': WEBHOOK_QUEUE,
+        }
+        for task_name, queue in routes.items():
+            route = app.amqp.router.route({}, task_name)
+            self.assertEqual(route['queue'].name, queue)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+@patch("users.tasks.send_email_notification.delay", side_effect=send_email_notification.run)
+@patch("users.tasks.weather_city", return_value={"city": "Kyiv, UA", "temperature": 20, "feels_like": 19, "humidity": 40})
+class NotificationDeliveryTest(TestCase):
+    """Tests for the notification delivery ledger."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='Ivan', email='ivan@test.com', password='Bt41stT123')
+        city = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        self.slot = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=1)
+        self.sub = Subscription.objects.create(user=user, city=city, next_send_at=self.slot, period_push=3)
+
+    def test_redelivered_slot_is_sent_once(self, *mocks):
+        """Running the task twice for the same slot sends one email and reschedules once."""
+        send_weather_notification.run(self.sub.id, self.slot.isoformat())
+        self.sub.refresh_from_db()
+        next_send_at = self.sub.next_send_at
+        send_weather_notification.run(self.sub.id, self.slot.isoformat())
+
+        self.assertEqual(len(mail.outbox), 1)
+        delivery = NotificationDelivery.objects.get(subscription=self.sub, scheduled_slot=self.slot)
+        self.assertEqual(delivery.email_status, NotificationDelivery.Status.SENT)
+        self.assertEqual(delivery.webhook_status, NotificationDelivery.Status.SKIPPED)
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.next_send_at, next_send_at)
+        self.assertGreater(next_send_at, self.slot)
+
+    def test_duplicate_task_does_not_resend(self, *mocks):
+        """A second task for a slot that is being sent fails to claim it and sends nothing."""
+        delivery = NotificationDelivery.objects.create(subscription=self.sub, scheduled_slot=self.slot)
+        args = (delivery.id, "ivan@test.com", "Weather in: Kyiv", "Hello")
+        send_mail = mail.send_mail
+
+        def send_during_duplicate(**kwargs):
+            send_email_notification.run(*args)
+            return send_mail(**kwargs)
+
+        with patch("users.tasks.send_mail", side_effect=send_during_duplicate) as mock_send:
+            send_email_notification.run(*args)
+            send_email_notification.run(*args)
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(len(mail.outbox), 1)
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.email_status, NotificationDelivery.Status.SENT)
+
+    def test_failed_email_is_retried(self, *mocks):
+        """An SMTP error retries the email and marks it FAILED once the retries are used up."""
+        delivery = NotificationDelivery.objects.create(subscription=self.sub, scheduled_slot=self.slot)
+        args = (delivery.id, "ivan@test.com", "Weather in: Kyiv", "Hello")
+        with patch("users.tasks.send_mail", side_effect=[smtplib.SMTPServerDisconnected(), 1]) as mock_send:
+            send_email_notification.apply(args=args)
+        self.assertEqual(mock_send.call_count, 2)
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.email_status, NotificationDelivery.Status.SENT)
+
+        NotificationDelivery.mark(delivery.id, email_status=NotificationDelivery.Status.PENDING)
+        with patch("users.tasks.send_mail", side_effect=smtplib.SMTPServerDisconnected()) as mock_send:
+            send_email_notification.apply(args=args)
+        self.assertEqual(mock_send.call_count, send_email_notification.max_retries + 1)
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.email_status, NotificationDelivery.Status.FAILED)
+
+    @patch("users.tasks.send_city_notifications.delay")
+    def test_stale_claim_is_released(self, mock_task, *mocks):
+        """A channel left SENDING by a dead worker goes back to PENDING on the next check."""
+        Status = NotificationDelivery.Status
+        delivery = NotificationDelivery.objects.create(
+            subscription=self.sub, scheduled_slot=self.slot, email_status=Status.SENDING, webhook_status=Status.SKIPPED
+        )
+        check_due_subscriptions.run()
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.email_status, Status.SENDING)
+
+        NotificationDelivery.objects.filter(id=delivery.id).update(
+            updated_at=datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1)
+        )
+        check_due_subscriptions.run()
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.email_status, Status.PENDING)
+        self.assertEqual(delivery.webhook_status, Status.SKIPPED)
+
+    @patch("users.tasks.send_city_notifications.delay")
+    def test_check_due_subscriptions_creates_ledger_rows(self, mock_task, *mocks):
+        """Due slots are inserted into the ledger once, however often the check runs."""
+        check_due_subscriptions.run()
+        check_due_subscriptions.run()
+        self.assertEqual(NotificationDelivery.objects.filter(subscription=self.sub).count(), 1)
+        mock_task.assert_called_with(self.sub.city_id, [[self.sub.id, self.slot.isoformat()]])
+
+
+class ShardingTest(TestCase):
+    """Tests for the city-hash sharding of notification work."""
+
+    def test_adding_a_shard_only_moves_its_cities(self):
+        """Cities either stay on their shard or move to the new one, about 1/N of them."""
+        old = HashRing(['notify-0', 'notify-1', 'notify-2'])
+        new = HashRing(['notify-0', 'notify-1', 'notify-2', 'notify-3'])
+        moved = [city_id for city_id in range(4000) if old.node_for(city_id) != new.node_for(city_id)]
+        self.assertTrue(all(new.node_for(city_id) == 'notify-3' for city_id in moved))
+        self.assertAlmostEqual(len(moved) / 4000, 1 / 4, delta=0.08)
+
+    def test_city_notifications_are_routed_to_their_shard(self):
+        route = app.amqp.router.route({}, 'users.tasks.send_city_notifications', args=(7, []))
+        self.assertEqual(route['queue'].name, WEATHER_QUEUE)
+        with override_settings(NOTIFICATION_SHARDS=['notify-0', 'notify-1']):
+            route = app.amqp.router.route({}, 'users.tasks.send_city_notifications', args=(7, []))
+            self.assertEqual(route['queue'].name, shard_queue(7))
+            self.assertIn(route['queue'].name, ['notify-0', 'notify-1'])
+            self.assertEqual(route['priority'], PRIORITY_NORMAL)
+
+
+class ShardCacheTest(TestCase):
+    """Tests for the per-worker cache of a shard's weather and subscribers."""
+
+    def setUp(self):
+        shard_cache.clear()
+        self.city = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        user = User.objects.create_user(username='Ivan', email='ivan@test.com', password='Bt41stT123')
+        self.sub = Subscription.objects.create(user=user, city=self.city)
+
+    def test_subscribers_are_reused_until_changed(self):
+        shard_cache.subscriptions(self.city.id, [self.sub.id])
+        with self.assertNumQueries(1):
+            subscriptions = shard_cache.subscriptions(self.city.id, [self.sub.id])
+        self.assertEqual(subscriptions[0].user.email, 'ivan@test.com')
+
+        self.sub.email_push = False
+        self.sub.save()
+        self.assertFalse(shard_cache.subscriptions(self.city.id, [self.sub.id])[0].email_push)
+        self.sub.delete()
+        self.assertEqual(shard_cache.subscriptions(self.city.id, [self.sub.id]), [])
+        self.assertEqual(shard_cache.stats()['subscribers']['misses'], 2)
+
+    def test_weather_is_loaded_once(self):
+        load = MagicMock(return_value={"city": "Kyiv, UA", "temperature": 20})
+        for _ in range(3):
+            self.assertEqual(shard_cache.weather(self.city, load)["temperature"], 20)
+        load.assert_called_once_with(self.city)
+        self.assertEqual(shard_cache.stats()['weather']['hit_rate'], round(2 / 3, 3))
+
+    def test_expired_and_oldest_cities_are_dropped(self):
+        cache = ShardCache(max_cities=2)
+        load = MagicMock(return_value={"temperature": 20})
+        with patch("users.shard_cache.time.monotonic", return_value=1000.0):
+            for city_id in (1, 2, 3):
+                cache.weather(MagicMock(id=city_id), load)
+        self.assertEqual(list(cache._weather), [2, 3])
+        with patch("users.shard_cache.time.monotonic", return_value=1000.0 + SHARD_WEATHER_SECONDS):
+            cache.weather(MagicMock(id=4), load)
+        self.assertEqual(list(cache._weather), [4])
+
+    def test_stats_are_collected_from_pool_processes(self):
+        """The inspect command, run in the worker's main process, reads the stats published by its pool."""
+        shard_cache.weather(self.city, MagicMock(return_value={"temperature": 20}))
+        shard_cache.publish_stats('celery@test')
+        state = MagicMock()
+        state.consumer.hostname = 'celery@test'
+        state.consumer.pool.info = {'processes': [os.getpid(), os.getpid() + 1]}
+        stats = shard_cache_stats(state)
+        self.assertEqual(list(stats), [str(os.getpid())])
+        self.assertEqual(stats[str(os.getpid())]['weather']['misses'], 1)
+
+
+class CacheLockTest(TestCase):
+    """Tests for the token-owned cache lock, on LocMemCache and on Redis (fakeredis, with its Lua support)."""
+
+    def setUp(self):
+        self.redis_cache = RedisCache('redis://localhost:6379/1', {
+            'KEY_PREFIX': 'lock-test',
+            'OPTIONS': {'connection_class': fakeredis.FakeConnection, 'server': fakeredis.FakeServer()},
+        })
+
+    def test_lock_is_owned_by_its_token(self):
+        """Only the holder of a lock can renew or release it."""
+        for backend in (caches['default'], self.redis_cache):
+            with self.subTest(backend=type(backend).__name__):
+                first = CacheLock("lock-test", expire=30, cache=backend)
+                second = CacheLock("lock-test", expire=30, cache=backend)
+                self.assertTrue(first.acquire())
+                self.assertFalse(second.acquire())
+                self.assertFalse(second.release())
+                self.assertTrue(first.renew())
+
+                first.release()
+                self.assertTrue(second.acquire())
+                self.assertFalse(first.renew())
+                second.release()
+
+    def test_expired_lock_taken_over_on_redis(self):
+        """After its lock expired and was taken over, the old owner can neither release nor extend it."""
+        first = CacheLock("lock-test", expire=30, cache=self.redis_cache)
+        self.assertTrue(first.acquire())
+        client, key = first._redis()
+        self.assertEqual(client.ttl(key), 30)
+        self.assertTrue(first.renew(120))
+        self.assertEqual(client.ttl(key), 120)
+
+        client.delete(key)
+        second = CacheLock("lock-test", expire=30, cache=self.redis_cache)
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.renew())
+        first.acquired = True
+        self.assertFalse(first.release())
+        self.assertEqual(client.get(key).decode(), second.token)
+
+    def test_unsupported_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CacheLock("lock-test", cache=DummyCache('dummy', {}))
+
+
+class DatabaseMetricsTest(APITestCase):
+    """Tests for the database connection metrics endpoint."""
+
+    def test_metrics_require_admin(self):
+        """Only staff users can read connection metrics."""
+        url = reverse('metrics-database')
+        user = User.objects.create_user(username='Ivan', email='ivan@test.com', password='Bt41stT123')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('default', response.data)
+
+
+class CachedBasicAuthenticationTest(APITestCase):
+    """Tests for the BasicAuthentication verification cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='IvanTest', email='ivan@testovich.com', password='Bt41BBT103')
+        self.url = reverse('subscription-list')
+
+    def basic(self, password):
+        return 'Basic ' + base64.b64encode(f'IvanTest:{password}'.encode()).decode()
+
+    def test_password_is_hashed_once(self):
+        """Repeated requests with the same credentials only run the password hasher once."""
+        with patch.object(User, 'check_password', autospec=True, side_effect=User.check_password) as check:
+            for _ in range(3):
+                response = self.client.get(self.url, HTTP_AUTHORIZATION=self.basic('Bt41BBT103'))
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(check.call_count, 1)
+
+    def test_password_hash_stays_out_of_cache(self):
+        self.client.get(self.url, HTTP_AUTHORIZATION=self.basic('Bt41BBT103'))
+        key = CachedBasicAuthentication().cache_key('IvanTest', 'Bt41BBT103')
+        self.assertEqual(cache.get(key), (self.user.pk, self.user.get_session_auth_hash()))
+        self.assertNotIn(self.user.password, repr(cache.get(key)))
+
+    def test_password_change_invalidates_cache(self):
+        """Cached credentials stop working as soon as the password changes."""
+        self.client.get(self.url, HTTP_AUTHORIZATION=self.basic('Bt41BBT103'))
+        self.user.set_password('Nw52CCT214')
+        self.user.save()
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.basic('Bt41BBT103'))
+        self.assertEqual(response.status_code, 401)
+
+
+class SubscriptionBulkAPITest(APITestCase):
+    """Integration tests for the bulk subscription API."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='IvanTest', email='ivan@testovich.com', password='Bt41BBT103')
+        self.client.force_authenticate(self.user)
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        self.url = reverse('subscription-bulk')
+        cache.clear()
+        shard_cache.clear()
+
+    @patch("users.views.send_city_notifications.delay")
+    @patch("weather.providers.requests.get")
+    def test_bulk_subscribe(self, mock_get, mock_task):
+        """Known cities are reused, unknown ones geocoded, existing subscriptions updated."""
+        Subscription.objects.create(user=self.user, city=self.kyiv, period_push=3)
+        mock_get.side_effect = lambda url, **kwargs: MagicMock(status_code=200, json=MagicMock(return_value=(
+            [{"name": "Lviv", "country": "UA", "lat": 49.84, "lon": 24.03}] if "q=lviv" in url else []
+        )))
+        data = [
+            {"city": "kyiv", "country": "ua", "period_push": 6},
+            {"city": "lviv", "country": "UA", "email_push": False},
+            {"city": "Nowhere", "country": "UA"},
+        ]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["subscriptions"]), 2)
+        self.assertEqual(response.data["errors"][0]["city"], "Nowhere")
+        self.assertEqual(mock_get.call_count, 2)
+
+        self.assertEqual(Subscription.objects.get(user=self.user, city=self.kyiv).period_push, 6)
+        lviv_sub = Subscription.objects.get(user=self.user, city__name="Lviv")
+        self.assertFalse(lviv_sub.email_push)
+        self.assertIsNotNone(lviv_sub.next_send_at)
+        self.assertEqual(mock_task.call_count, 2)
+
+    @patch("users.views.send_city_notifications.delay")
+    @patch("weather.providers.requests.get")
+    def test_aliases_of_one_city(self, mock_get, mock_task):
+        """Names geocoding to the same city are stored once and all resolve to it."""
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value=(
+            [{"name": "Lviv", "country": "UA", "lat": 49.84, "lon": 24.03}]
+        )))
+        data = [{"city": "Lemberg", "country": "UA"}, {"city": "Lwow", "country": "UA", "period_push": 6}]
+        with patch.object(City.objects, 'bulk_create', wraps=City.objects.bulk_create) as bulk_create:
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["errors"], [])
+        self.assertEqual(len(bulk_create.call_args.args[0]), 1)
+        self.assertEqual(City.objects.filter(name="Lviv").count(), 1)
+        self.assertEqual(Subscription.objects.get(user=self.user, city__name="Lviv").period_push, 6)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    @patch("users.tasks.send_email_notification.delay", side_effect=send_email_notification.run)
+    @patch("users.tasks.weather_city", return_value={"city": "Kyiv, UA", "temperature": 20, "feels_like": 19, "humidity": 40})
+    def test_city_notifications_share_one_fetch(self, mock_weather, mock_email):
+        """Subscriptions of one city are notified with a single weather fetch."""
+        other = User.objects.create_user(username='Petro', email='petro@test.com', password='Bt41BBT103')
+        slot = datetime.datetime.now(datetime.timezone.utc)
+        subs = [
+            Subscription.objects.create(user=user, city=self.kyiv, period_push=3, next_send_at=slot)
+            for user in (self.user, other)
+        ]
+        subscription_slots = [[sub.id, slot.isoformat()] for sub in subs]
+        send_city_notifications.run(self.kyiv.id, subscription_slots)
+        send_city_notifications.run(self.kyiv.id, subscription_slots)
+        self.assertEqual(mock_weather.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    @patch("users.tasks.send_email_notification.delay")
+    @patch("users.tasks.weather_city", return_value={"city": "Kyiv, UA", "temperature": 20, "feels_like": 19, "humidity": 40})
+    def test_locked_city_is_retried(self, mock_weather, mock_email):
+        """A city task running into another one for the same city is retried instead of dropping its slots."""
+        slot = datetime.datetime.now(datetime.timezone.utc)
+        sub = Subscription.objects.create(user=self.user, city=self.kyiv, period_push=3, next_send_at=slot)
+        lock = CacheLock(f"citylock-{self.kyiv.id}", expire=30)
+        self.assertTrue(lock.acquire())
+        with patch.object(send_city_notifications, 'retry', side_effect=Retry()) as mock_retry:
+            with self.assertRaises(Retry):
+                send_city_notifications.run(self.kyiv.id, [[sub.id, slot.isoformat()]])
+        mock_retry.assert_called_once_with(countdown=CITY_LOCK_RETRY_SECONDS)
+        mock_email.assert_not_called()
+
+        lock.release()
+        send_city_notifications.run(self.kyiv.id, [[sub.id, slot.isoformat()]])
+        mock_email.assert_called_once()
@@ -1,14 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from users.views import UserViewSet, RegisterView, SubscriptionViewSet, SubscriptionCityView
+from users.views import (
+    UserViewSet, RegisterView, SubscriptionViewSet, SubscriptionCityView, SubscriptionExportView,
+    SubscriptionBulkView
+)
 
 router = DefaultRouter()
 router.register('users', UserViewSet, basename='user')
 router.register(r'subscription', SubscriptionViewSet, basename='subscription')
 
 urlpatterns = [
+    path('subscription/bulk/', SubscriptionBulkView.as_view(), name='subscription-bulk'),
     path('', include(router.urls)),
     path('register/', RegisterView.as_view(), name='register'),
     path("cities/<str:city_name>/<str:country_code>/weather/subscription/", SubscriptionCityView.as_view(),
          name="city-weather-subscription"),
+    path("export/subscriptions/", SubscriptionExportView.as_view(), name="export-subscriptions"),
 ]
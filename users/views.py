@@ -1,14 +1,20 @@
 from django.core.exceptions import ValidationError
+from django.db.models import F
+from collections import defaultdict
 from rest_framework import viewsets, permissions, generics
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from users.authentication import STATELESS_AUTHENTICATION_CLASSES
 from users.models import User, Subscription
-from users.serializers import UserSerializer, RegisterSerializer, SubscriptionSerializer
-from users.tasks import send_weather_notification
+from users.serializers import UserSerializer, RegisterSerializer, SubscriptionSerializer, SubscriptionBulkEntrySerializer
+from users.services import bulk_subscribe
+from users.tasks import send_weather_notification, send_city_notifications
+from weather.exports import export_response
 from weather.models import City
 from weather.services import find_city
+from weather.snapshot import lookup_city
 
 
 class RegisterView(generics.CreateAPIView):
@@ -28,13 +34,74 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
 class SubscriptionViewSet(viewsets.ReadOnlyModelViewSet):
     """API endpoint for viewing user subscriptions."""
     serializer_class = SubscriptionSerializer
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    query_budget = 1
 
     def get_queryset(self):
-        return Subscription.objects.filter(user=self.request.user).order_by('id')
+        return Subscription.objects.select_related('city').filter(user_id=self.request.user.id).order_by('id')
+
+
+class SubscriptionBulkView(APIView):
+    """API endpoint for creating or updating many subscriptions of the authenticated user in one request."""
+    max_entries = 1000
+
+    def post(self, request) -> Response:
+        """
+        Subscribes the user to every city in the list, updating existing subscriptions.
+
+        Cities are resolved in one batch and the initial notifications are sent with one task per city.
+
+        Args:
+            request: DRF request object with a list of entries: city, country and the subscription options.
+        """
+        serializer = SubscriptionBulkEntrySerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > self.max_entries:
+            return Response({"error": f"At most {self.max_entries} entries per request"}, status=400)
+
+        subscriptions, failed = bulk_subscribe(request.user.id, serializer.validated_data)
+
+        by_city = defaultdict(list)
+        for subscription in subscriptions:
+            by_city[subscription.city_id].append([subscription.id, subscription.next_send_at.isoformat()])
+        for city_id, subscription_slots in by_city.items():
+            send_city_notifications.delay(city_id, subscription_slots)
+
+        return Response({
+            'user': request.user.username,
+            'email': request.user.email,
+            'subscriptions': [
+                {
+                    'city': subscription.city.name,
+                    'country': subscription.city.country,
+                    'email_push': subscription.email_push,
+                    'webhook_url': subscription.webhook_url,
+                    'period_push': subscription.period_push,
+                }
+                for subscription in subscriptions
+            ],
+            'errors': failed,
+        })
+
+
+class SubscriptionExportView(APIView):
+    """Streams the user's subscriptions as NDJSON (default) or CSV, selected with ``?output=csv``."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+
+    def get(self, request):
+        return export_response(
+            request,
+            Subscription.objects.filter(user_id=request.user.id).order_by('id'),
+            ['id', 'city_id', 'email_push', 'webhook_url', 'period_push', 'next_send_at', 'created_at', 'updated_at'],
+            'subscriptions',
+            city_name=F('city__name'),
+            country=F('city__country'),
+        )
 
 
 class SubscriptionCityView(APIView):
     """API endpoint for managing subscriptions for a specific city."""
+    query_budget = 4
 
     def get_city(self, city_name: str, country_code: str) -> City | None:
         """
@@ -47,7 +114,7 @@ class SubscriptionCityView(APIView):
         Returns:
             City or None: Returns a City instance if found, otherwise None.
         """
-        city = City.objects.filter(name=city_name, country=country_code).first()
+        city = lookup_city(city_name, country_code)
         if not city:
             city_data = find_city(city_name, country_code)
             city = City.objects.filter(name=city_data["name"], country=city_data["country"]).first()
@@ -83,16 +150,17 @@ class SubscriptionCityView(APIView):
         serializer = SubscriptionSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        subscription = Subscription.objects.create(
+        subscription = Subscription(
             user=request.user,
             city=city,
             email_push=serializer.validated_data.get("email_push", True),
             webhook_url=serializer.validated_data.get("webhook_url", None),
             period_push=serializer.validated_data.get("period_push", 12),
         )
+        subscription.schedule_next(save=False)
+        subscription.save()
 
-        subscription.schedule_next()
-        send_weather_notification.delay(subscription.id)
+        send_weather_notification.delay(subscription.id, subscription.next_send_at.isoformat())
 
         return Response({
             'user': request.user.username,
@@ -155,10 +223,9 @@ class SubscriptionCityView(APIView):
         subscription.email_push = serializer.validated_data.get("email_push", True)
         subscription.webhook_url = serializer.validated_data.get("webhook_url", None)
         subscription.period_push = serializer.validated_data.get("period_push", 12)
-        subscription.save()
-
         subscription.schedule_next()
-        send_weather_notification.delay(subscription.id)
+
+        send_weather_notification.delay(subscription.id, subscription.next_send_at.isoformat())
 
         return Response({
             'user': request.user.username,
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class WeatherConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather'
+
+    def ready(self):
+        from celery.signals import worker_process_shutdown
+        from weather import snapshot  # noqa: F401 (keeps the City snapshot in sync with City saves and deletes)
+        from weather.replay import flush_recorder
+        from weather.services import weather_buffer
+
+        # Pending WeatherRecord writes and upstream recordings of a Celery child process are flushed before
+        # it exits: prefork children leave through os._exit, which skips atexit handlers.
+        worker_process_shutdown.connect(lambda **kwargs: weather_buffer.flush(), weak=False)
+        worker_process_shutdown.connect(lambda **kwargs: flush_recorder(), weak=False)
@@ -0,0 +1,203 @@
+import datetime
+import math
+import sys
+import time
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from DjangoWeatherReminder.profiling import upstream
+from weather.models import City, Forecast
+from weather.providers import upstream_text
+from weather.replay import record_upstream
+from weather.services import grid_cell
+
+FORECAST_SERIES = ['temperature', 'humidity', 'precipitation_probability', 'precipitation']
+FORECAST_WORKERS = 8
+RAIN_PROBABILITY = 0.5
+
+
+def pack_series(values) -> bytes:
+    """Packs a sequence of floats into little-endian float32 bytes."""
+    series = array('f', values)
+    if sys.byteorder == 'big':
+        series.byteswap()
+    return series.tobytes()
+
+
+def unpack_series(blob) -> array:
+    """Unpacks bytes written by `pack_series` into a float32 array."""
+    series = array('f')
+    series.frombytes(blob)
+    if sys.byteorder == 'big':
+        series.byteswap()
+    return series
+
+
+def fetch_forecast(lat, lon) -> dict:
+    """
+    Retrieve the multi-day forecast for a place using the OpenWeatherMap 5 day / 3 hour API.
+
+    Args:
+        lat: Latitude of the place.
+        lon: Longitude of the place.
+
+    Returns:
+        dict: starts_at, step_seconds and one list per FORECAST_SERIES entry, with NaN for missing steps.
+
+    Raises:
+        ValidationError: If the upstream fails or answers with a forecast that cannot be read.
+    """
+    url = f"{settings.OPENWEATHER_URL}/data/2.5/forecast?lat={lat}&lon={lon}&units=metric&appid={settings.API_KEY}"
+    started = time.perf_counter()
+    with upstream():
+        res = requests.get(url, timeout=settings.UPSTREAM_TIMEOUT)
+    record_upstream(url, res, time.perf_counter() - started)
+    if res.status_code != 200:
+        raise ValidationError({"error": "Weather service error", "details": upstream_text(res.text)})
+    try:
+        items = res.json().get("list")
+        if not items:
+            raise ValidationError({"error": "Forecast not found", "details": f"{lat}, {lon}"})
+        return parse_forecast(items)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValidationError({"error": "Invalid forecast", "details": f"{lat}, {lon}: {type(e).__name__}: {e}"})
+
+
+def parse_forecast(items: list) -> dict:
+    """
+    Lays the items of an OpenWeatherMap forecast out on a regular time grid.
+
+    Raises:
+        ValueError: If the steps are not increasing.
+        KeyError: If an item lacks a required field.
+    """
+    first = items[0]["dt"]
+    step = items[1]["dt"] - first if len(items) > 1 else 3 * 3600
+    if step <= 0:
+        raise ValueError(f"step of {step} seconds")
+    size = (items[-1]["dt"] - first) // step + 1
+    forecast = {name: [math.nan] * size for name in FORECAST_SERIES}
+    for item in items:
+        index = (item["dt"] - first) // step
+        if not 0 <= index < size:
+            raise ValueError(f"dt {item['dt']} outside of the forecast")
+        forecast["temperature"][index] = item["main"]["temp"]
+        forecast["humidity"][index] = item["main"]["humidity"]
+        forecast["precipitation_probability"][index] = item.get("pop", 0)
+        forecast["precipitation"][index] = item.get("rain", {}).get("3h", 0)
+
+    forecast["starts_at"] = datetime.datetime.fromtimestamp(first, datetime.timezone.utc)
+    forecast["step_seconds"] = step
+    return forecast
+
+
+def refresh_forecasts(cities: list[City]) -> int:
+    """
+    Fetches forecasts for many cities concurrently and stores them as one new run per city.
+
+    Cities in the same grid cell (see `weather.services.grid_cell`) share one fetch. Older runs of the
+    refreshed cities are removed, so each city keeps only its latest run.
+
+    Args:
+        cities (list): The cities to refresh.
+
+    Returns:
+        int: The number of cities stored.
+    """
+
+    def fetch(centre):
+        try:
+            return fetch_forecast(*centre)
+        except (ValidationError, requests.RequestException):
+            return None
+
+    if not cities:
+        return 0
+    cells = defaultdict(list)
+    centres = {}
+    for city in cities:
+        cell, centres[cell] = grid_cell(city.lat, city.lon)
+        cells[cell].append(city)
+    with ThreadPoolExecutor(max_workers=min(FORECAST_WORKERS, len(cells))) as pool:
+        forecasts = dict(zip(cells, pool.map(fetch, [centres[cell] for cell in cells])))
+    results = [(city, forecasts[cell]) for cell, members in cells.items() if forecasts[cell] for city in members]
+
+    run_at = datetime.datetime.now(datetime.timezone.utc)
+    Forecast.objects.bulk_create([
+        Forecast(
+            city=city,
+            run_at=run_at,
+            starts_at=forecast["starts_at"],
+            step_seconds=forecast["step_seconds"],
+            **{name: pack_series(forecast[name]) for name in FORECAST_SERIES},
+        )
+        for city, forecast in results
+    ])
+    Forecast.objects.filter(city__in=[city for city, _ in results], run_at__lt=run_at).delete()
+    return len(results)
+
+
+def latest_forecasts(city_ids) -> dict:
+    """Returns the latest Forecast of each city, keyed by city id."""
+    forecasts = {}
+    for forecast in Forecast.objects.filter(city_id__in=city_ids).order_by('city_id', '-run_at'):
+        forecasts.setdefault(forecast.city_id, forecast)
+    return forecasts
+
+
+def forecast_window(forecast: Forecast, start: datetime.datetime, hours: int) -> dict:
+    """
+    Slices every series of a forecast to the steps between `start` and `start + hours`.
+
+    Args:
+        forecast (Forecast): The stored forecast.
+        start (datetime): Beginning of the window.
+        hours (int): Length of the window.
+
+    Returns:
+        dict: `times` (datetimes of the steps) and one float32 array per FORECAST_SERIES entry.
+    """
+    step = forecast.step_seconds
+    first = max(0, math.ceil((start - forecast.starts_at).total_seconds() / step))
+    window = slice(first, first + hours * 3600 // step)
+    series = {name: unpack_series(getattr(forecast, name))[window] for name in FORECAST_SERIES}
+    count = len(series["temperature"])
+    series["times"] = [forecast.starts_at + datetime.timedelta(seconds=step * (first + i)) for i in range(count)]
+    return series
+
+
+def rounded(value: float, digits: int | None = None) -> float | int | None:
+    """Rounds a forecast value, or returns None for a step missing from the upstream series."""
+    return round(value, digits) if math.isfinite(value) else None
+
+
+def summarize_window(window: dict) -> dict:
+    """
+    Reduces a forecast window to the values needed for "will it rain" style questions.
+
+    Args:
+        window (dict): The result of `forecast_window`.
+
+    Returns:
+        dict: Temperature range, highest precipitation probability, total precipitation and `will_rain`.
+    """
+    def known(values):
+        return [round(value, 2) for value in values if not math.isnan(value)]
+
+    temperature = known(window["temperature"])
+    probability = known(window["precipitation_probability"])
+    precipitation = known(window["precipitation"])
+    max_probability = max(probability, default=None)
+    total_precipitation = round(sum(precipitation), 2)
+    return {
+        "min_temperature": min(temperature, default=None),
+        "max_temperature": max(temperature, default=None),
+        "max_precipitation_probability": max_probability,
+        "total_precipitation": total_precipitation,
+        "will_rain": (max_probability or 0) >= RAIN_PROBABILITY or total_precipitation > 0,
+    }
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import secrets
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from redis import asyncio as aioredis
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+LIVE_PATH = '/api/live/weather/'
+LIVE_CHANNEL_PREFIX = 'weather:live:'
+LIVE_KEEPALIVE_SECONDS = 15
+LIVE_MAX_CITIES = 50
+LIVE_QUEUE_SIZE = 16
+LIVE_TICKET_SECONDS = 30
+LIVE_RECONNECT_SECONDS = 1.0
+LIVE_RECONNECT_MAX_SECONDS = 30.0
+
+
+def ticket_key(ticket: str) -> str:
+    return f"live:ticket:{ticket}"
+
+
+def issue_ticket(user_id: int) -> str:
+    """Creates a single-use ticket opening one live stream within LIVE_TICKET_SECONDS."""
+    ticket = secrets.token_urlsafe(24)
+    cache.set(ticket_key(ticket), user_id, LIVE_TICKET_SECONDS)
+    return ticket
+
+
+class InProcessBroker:
+    """
+    Fans weather updates out to the live connections of this process.
+
+    `publish` may be called from any thread; each subscriber is an asyncio queue drained by its
+    connection. A subscriber that falls behind loses its oldest updates instead of growing without bound.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish_many(self, messages: list[dict]):
+        for message in messages:
+            self.deliver(message["city_id"], json.dumps(message, cls=DjangoJSONEncoder))
+
+    def deliver(self, city_id: int, data: str):
+        with self._lock:
+            targets = list(self._subscribers.get(city_id, ()))
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(self._offer, queue, data)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, data: str):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+    @contextmanager
+    def subscribe(self, city_ids):
+        """Yields a queue receiving the JSON updates of the given cities until the block exits."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=LIVE_QUEUE_SIZE))
+        with self._lock:
+            for city_id in city_ids:
+                self._subscribers[city_id].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                for city_id in city_ids:
+                    self._subscribers[city_id].discard(subscriber)
+                    if not self._subscribers[city_id]:
+                        del self._subscribers[city_id]
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Publishes weather updates through Redis pub/sub.
+
+    Each process holds a single pattern subscription, started with the first live connection, and fans the
+    messages out locally, so the number of Redis connections does not grow with the number of clients.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def publish_many(self, messages: list[dict]):
+        try:
+            with self._client.pipeline(transaction=False) as pipe:
+                for message in messages:
+                    pipe.publish(f"{LIVE_CHANNEL_PREFIX}{message['city_id']}", json.dumps(message, cls=DjangoJSONEncoder))
+                pipe.execute()
+        except redis.RedisError:
+            logger.warning("Could not publish %d live weather updates", len(messages), exc_info=True)
+
+    async def _listen(self):
+        """Relays the Redis messages to the local subscribers, reconnecting with backoff when the connection fails."""
+        delay = LIVE_RECONNECT_SECONDS
+        while True:
+            client = aioredis.Redis.from_url(self.url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f"{LIVE_CHANNEL_PREFIX}*")
+                    delay = LIVE_RECONNECT_SECONDS
+                    async for message in pubsub.listen():
+                        if message["type"] == "pmessage":
+                            city_id = int(message["channel"].decode().removeprefix(LIVE_CHANNEL_PREFIX))
+                            self.deliver(city_id, message["data"].decode())
+            except Exception:
+                logger.warning("Live weather listener failed, reconnecting in %.0f s", delay, exc_info=True)
+            finally:
+                await client.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LIVE_RECONNECT_MAX_SECONDS)
+
+    @contextmanager
+    def subscribe(self, city_ids):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        with super().subscribe(city_ids) as queue:
+            yield queue
+
+
+_broker = None
+
+
+def get_broker() -> InProcessBroker:
+    """Returns the process-wide broker selected by the LIVE_WEATHER_BROKER setting."""
+    global _broker
+    if _broker is None:
+        if settings.LIVE_WEATHER_BROKER == 'redis':
+            _broker = RedisBroker(f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/2')
+        else:
+            _broker = InProcessBroker()
+    return _broker
+
+
+async def _authenticate(scope, query) -> bool:
+    """
+    Validates the JWT access token of a Bearer header or, for EventSource clients that cannot send headers,
+    a ticket from `issue_ticket` given as ?ticket=. Tokens are not accepted in the query string, where they
+    would end up in access logs.
+    """
+    headers = dict(scope.get('headers', []))
+    raw = headers.get(b'authorization', b'').decode()
+    if not raw.startswith('Bearer '):
+        ticket = query.get('ticket', [''])[0]
+        # Deleting the ticket is what validates it, so it opens one stream only.
+        return bool(ticket) and await cache.adelete(ticket_key(ticket))
+    try:
+        AccessToken(raw.removeprefix('Bearer ').strip())
+    except TokenError:
+        return False
+    return True
+
+
+async def _respond(send, status: int, body: dict):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def live_weather_app(scope, receive, send):
+    """
+    ASGI app streaming weather updates as Server-Sent Events.
+
+    ``GET /api/live/weather/?cities=1,2`` keeps the connection open and sends an ``event: weather``
+    message whenever a new WeatherRecord of one of the cities is written. A comment line is sent every
+    LIVE_KEEPALIVE_SECONDS so proxies keep idle connections open.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if not await _authenticate(scope, query):
+        await _respond(send, 401, {"error": "Authentication credentials were not provided or are invalid."})
+        return
+    try:
+        city_ids = {int(city_id) for city_id in query.get('cities', [''])[0].split(',') if city_id}
+    except ValueError:
+        city_ids = set()
+    if not city_ids or len(city_ids) > LIVE_MAX_CITIES:
+        await _respond(send, 400, {"error": f"Pass 1 to {LIVE_MAX_CITIES} city ids as ?cities=1,2"})
+        return
+
+    with get_broker().subscribe(city_ids) as queue:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            while True:
+                update = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {update, disconnected}, timeout=LIVE_KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected in done:
+                    update.cancel()
+                    break
+                if update in done:
+                    chunk = f"event: weather\ndata: {update.result()}\n\n".encode()
+                else:
+                    update.cancel()
+                    chunk = b": keepalive\n\n"
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            disconnected.cancel()
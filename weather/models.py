@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class City(models.Model):
@@ -21,4 +22,30 @@ class WeatherRecord(models.Model):
     humidity = models.PositiveIntegerField()
     wind_speed = models.FloatField()
     pressure = models.FloatField()
-    recorded_at = models.DateTimeField(auto_now=True)
+    # When the observation was fetched upstream, which for cities sharing a grid cell precedes the write.
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city'], name='unique_weather_record_city'),
+        ]
+
+
+class Forecast(models.Model):
+    """
+    One upstream forecast run for a city.
+
+    Each series is a packed little-endian float32 array (see weather.forecasts) with one value per
+    `step_seconds`, starting at `starts_at`; missing values are NaN.
+    """
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='forecasts')
+    run_at = models.DateTimeField()
+    starts_at = models.DateTimeField()
+    step_seconds = models.PositiveIntegerField()
+    temperature = models.BinaryField()
+    humidity = models.BinaryField()
+    precipitation_probability = models.BinaryField()
+    precipitation = models.BinaryField()
+
+    class Meta:
+        unique_together = ('city', 'run_at')
@@ -0,0 +1,286 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from DjangoWeatherReminder.profiling import upstream
+from weather.replay import record_upstream
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+HEDGE_DEFAULT_SECONDS = 1.0
+HEDGE_MIN_SECONDS = 0.05
+HEDGE_WORKERS = 16
+PROVIDER_COOLDOWN_SECONDS = 30
+UPSTREAM_ERROR_CHARS = 200
+
+
+class ProviderError(Exception):
+    """A provider could not answer: transport error, error status or unexpected payload."""
+
+
+def upstream_text(text: str) -> str:
+    """Shortens an upstream response body for error messages and masks the API key in it."""
+    if settings.API_KEY:
+        text = text.replace(settings.API_KEY, '***')
+    return text[:UPSTREAM_ERROR_CHARS]
+
+
+class LatencyTracker:
+    """Keeps the latest response times of a provider and reports their percentiles."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> float | None:
+        """Returns the given percentile in seconds, or None until LATENCY_MIN_SAMPLES were recorded."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class WeatherProvider:
+    """
+    A source of current weather and geocoding.
+
+    Subclasses return results normalized to the shapes used by `weather.services`: WEATHER_FIELDS for
+    `current`, and name, country, lat and lon for `geocode`.
+    """
+    name = None
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.failures = 0
+        self.failed_until = 0.0
+
+    def current(self, lat, lon) -> dict:
+        raise NotImplementedError
+
+    def geocode(self, city_name: str, country_code: str) -> dict | None:
+        """Returns the best match for the city, or None if the provider does not know it."""
+        raise NotImplementedError
+
+    def get_json(self, url: str):
+        started = time.perf_counter()
+        with upstream():
+            try:
+                res = requests.get(url, timeout=settings.UPSTREAM_TIMEOUT)
+            except requests.RequestException as e:
+                # The exception text holds the URL and with it the API key, so it stays in the server log.
+                logger.warning("%s request failed", self.name, exc_info=True)
+                raise ProviderError(f"{self.name}: {type(e).__name__}") from e
+        record_upstream(url, res, time.perf_counter() - started)
+        if res.status_code != 200:
+            raise ProviderError(f"{self.name}: HTTP {res.status_code} {upstream_text(res.text)}")
+        return res.json()
+
+    @property
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.failed_until
+
+    def stats(self) -> dict:
+        p50, p95 = self.latency.percentile(0.5), self.latency.percentile(0.95)
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'p50_ms': None if p50 is None else round(p50 * 1000, 1),
+            'p95_ms': None if p95 is None else round(p95 * 1000, 1),
+            'cooling_down': self.cooling_down,
+        }
+
+
+class OpenWeatherMapProvider(WeatherProvider):
+    name = 'openweathermap'
+
+    def __init__(self, base_url: str, api_key: str):
+        super().__init__()
+        self.base_url = base_url
+        self.api_key = api_key
+
+    def current(self, lat, lon) -> dict:
+        data = self.get_json(f"{self.base_url}/data/2.5/weather?lat={lat}&lon={lon}&units=metric&appid={self.api_key}")
+        return {
+            'temperature': data["main"]["temp"],
+            'feels_like': data["main"]["feels_like"],
+            'humidity': data["main"]["humidity"],
+            'wind_speed': data["wind"]["speed"],
+            'pressure': data["main"]["pressure"],
+        }
+
+    def geocode(self, city_name: str, country_code: str) -> dict | None:
+        data = self.get_json(f"{self.base_url}/geo/1.0/direct?q={city_name},{country_code}&limit=1&appid={self.api_key}")
+        if not data:
+            return None
+        return {'name': data[0]["name"], 'country': data[0]["country"], 'lat': data[0]["lat"], 'lon': data[0]["lon"]}
+
+
+class OpenMeteoProvider(WeatherProvider):
+    name = 'open-meteo'
+
+    def __init__(self, base_url: str, geocoding_url: str):
+        super().__init__()
+        self.base_url = base_url
+        self.geocoding_url = geocoding_url
+
+    def current(self, lat, lon) -> dict:
+        data = self.get_json(
+            f"{self.base_url}/v1/forecast?latitude={lat}&longitude={lon}&wind_speed_unit=ms"
+            f"&current=temperature_2m,apparent_temperature,relative_humidity_2m,wind_speed_10m,pressure_msl"
+        )["current"]
+        return {
+            'temperature': data["temperature_2m"],
+            'feels_like': data["apparent_temperature"],
+            'humidity': data["relative_humidity_2m"],
+            'wind_speed': data["wind_speed_10m"],
+            'pressure': data["pressure_msl"],
+        }
+
+    def geocode(self, city_name: str, country_code: str) -> dict | None:
+        data = self.get_json(
+            f"{self.geocoding_url}/v1/search?name={city_name}&countryCode={country_code}&count=1&format=json"
+        )
+        results = data.get("results")
+        if not results:
+            return None
+        return {
+            'name': results[0]["name"],
+            'country': results[0]["country_code"],
+            'lat': results[0]["latitude"],
+            'lon': results[0]["longitude"],
+        }
+
+
+class ProviderChain:
+    """
+    Asks the first healthy provider and falls back to the next ones.
+
+    A provider that fails is skipped for PROVIDER_COOLDOWN_SECONDS. When a request to a provider takes
+    longer than its p95 latency, the same request is sent to the next provider and the first answer wins.
+    """
+
+    def __init__(self, providers: list[WeatherProvider]):
+        self.providers = providers
+        self.hedged = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='weather-provider')
+            return self._executor
+
+    def ordered(self) -> list[WeatherProvider]:
+        """Healthy providers first, in the configured order."""
+        return sorted(self.providers, key=lambda provider: provider.cooling_down)
+
+    @staticmethod
+    def hedge_delay(provider: WeatherProvider) -> float:
+        p95 = provider.latency.percentile(0.95)
+        return HEDGE_DEFAULT_SECONDS if p95 is None else max(p95, HEDGE_MIN_SECONDS)
+
+    @staticmethod
+    def attempt(provider: WeatherProvider, method: str, *args):
+        provider.calls += 1
+        started = time.perf_counter()
+        try:
+            result = getattr(provider, method)(*args)
+        except (ProviderError, KeyError, IndexError, TypeError, ValueError) as e:
+            provider.failures += 1
+            provider.failed_until = time.monotonic() + PROVIDER_COOLDOWN_SECONDS
+            if isinstance(e, ProviderError):
+                raise
+            raise ProviderError(f"{provider.name}: unexpected response ({e!r})") from e
+        provider.latency.add(time.perf_counter() - started)
+        return result
+
+    def call(self, method: str, *args):
+        """
+        Runs `method` on the providers with hedging and failover.
+
+        Raises:
+            ProviderError: If every provider failed.
+        """
+        providers = iter(self.ordered())
+        if len(self.providers) == 1:
+            return self.attempt(next(providers), method, *args)
+
+        pending = {}
+        errors = []
+
+        def launch():
+            provider = next(providers, None)
+            if provider is not None:
+                context = contextvars.copy_context()
+                pending[self.executor.submit(context.run, self.attempt, provider, method, *args)] = provider
+            return provider
+
+        last = launch()
+        while pending:
+            done, _ = wait(pending, timeout=self.hedge_delay(last) if last else None, return_when=FIRST_COMPLETED)
+            if not done:
+                last = launch()
+                if last is not None:
+                    self.hedged += 1
+                continue
+            for future in done:
+                del pending[future]
+                try:
+                    return future.result()
+                except ProviderError as e:
+                    errors.append(str(e))
+            last = launch()
+        raise ProviderError("; ".join(errors))
+
+    def current(self, lat, lon) -> dict:
+        return self.call('current', lat, lon)
+
+    def geocode(self, city_name: str, country_code: str) -> dict | None:
+        return self.call('geocode', city_name, country_code)
+
+    def stats(self) -> dict:
+        return {'hedged': self.hedged, 'providers': {provider.name: provider.stats() for provider in self.providers}}
+
+
+def build_provider(name: str) -> WeatherProvider:
+    if name == OpenWeatherMapProvider.name:
+        return OpenWeatherMapProvider(settings.OPENWEATHER_URL, settings.API_KEY)
+    if name == OpenMeteoProvider.name:
+        return OpenMeteoProvider(settings.OPEN_METEO_URL, settings.OPEN_METEO_GEOCODING_URL)
+    raise ValueError(f"Unknown weather provider: {name}")
+
+
+_chain = None
+
+
+def get_providers() -> ProviderChain:
+    """Returns the process-wide chain of the providers listed in the WEATHER_PROVIDERS setting."""
+    global _chain
+    if _chain is None:
+        _chain = ProviderChain([build_provider(name) for name in settings.WEATHER_PROVIDERS])
+    return _chain
+
+
+@receiver(setting_changed)
+def reset_providers(setting, **kwargs):
+    global _chain
+    if setting in ('WEATHER_PROVIDERS', 'OPENWEATHER_URL', 'API_KEY', 'OPEN_METEO_URL', 'OPEN_METEO_GEOCODING_URL'):
+        _chain = None
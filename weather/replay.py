@@ -0,0 +1,232 @@
+import atexit
+import gzip
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+RECORD_BATCH = 200
+# Query parameters left out of recordings, so that files can be shared without leaking credentials.
+SECRET_PARAMS = {'appid'}
+
+
+def recording_key(url: str) -> str:
+    """Path and sorted query of an upstream URL, without SECRET_PARAMS."""
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query) if name not in SECRET_PARAMS)
+    return f"{parts.path}?{urlencode(query)}" if query else parts.path
+
+
+class UpstreamRecorder:
+    """
+    Records upstream responses with their timing, and weather view hits, to a gzip JSON-lines file.
+
+    Entries are written in batches of `batch_size`, each batch as one gzip member appended with a single
+    write, so several processes can record to the same file.
+    """
+
+    def __init__(self, path: str, batch_size: int = RECORD_BATCH):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._entries = []
+
+    def add(self, entry: dict):
+        with self._lock:
+            self._entries.append(json.dumps(entry, separators=(',', ':')))
+            full = len(self._entries) >= self.batch_size
+        if full:
+            self.flush()
+
+    def upstream(self, url: str, status: int, body: str, seconds: float):
+        self.add({'kind': 'upstream', 't': time.time(), 'key': recording_key(url), 'status': status,
+                  'ms': round(seconds * 1000, 1), 'body': body})
+
+    def hit(self, city_name: str, country_code: str):
+        self.add({'kind': 'hit', 't': time.time(), 'city': city_name, 'country': country_code})
+
+    def flush(self) -> int:
+        """
+        Appends the pending entries to the file.
+
+        Returns:
+            int: The number of entries written.
+        """
+        with self._lock:
+            entries, self._entries = self._entries, []
+        if entries:
+            with open(self.path, 'ab') as f:
+                f.write(gzip.compress(('\n'.join(entries) + '\n').encode()))
+        return len(entries)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> UpstreamRecorder | None:
+    """
+    Returns the process-wide recorder writing to UPSTREAM_RECORD_PATH, or None when recording is off.
+
+    Its pending entries are flushed at exit, and by Celery child processes, which skip atexit handlers,
+    on worker_process_shutdown (WeatherConfig.ready).
+    """
+    global _recorder
+    if not settings.UPSTREAM_RECORD_PATH:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = UpstreamRecorder(settings.UPSTREAM_RECORD_PATH)
+            atexit.register(_recorder.flush)
+        return _recorder
+
+
+def flush_recorder():
+    """Writes the pending entries of the process-wide recorder, if there is one."""
+    if _recorder is not None:
+        _recorder.flush()
+
+
+@receiver(setting_changed)
+def reset_recorder(setting, **kwargs):
+    global _recorder
+    if setting == 'UPSTREAM_RECORD_PATH':
+        flush_recorder()
+        _recorder = None
+
+
+def record_upstream(url: str, response, seconds: float):
+    """Records an upstream response when UPSTREAM_RECORD_PATH is set."""
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.upstream(url, response.status_code, response.text, seconds)
+
+
+def record_hit(city_name: str, country_code: str):
+    """Records a weather view hit when UPSTREAM_RECORD_PATH is set."""
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.hit(city_name, country_code)
+
+
+class Recording:
+    """The weather view hits and upstream responses of one or more recording files."""
+
+    def __init__(self, paths):
+        self.hits = []
+        self.responses = defaultdict(list)
+        for path in [paths] if isinstance(paths, str) else paths:
+            with gzip.open(path, 'rt') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry['kind'] == 'hit':
+                        self.hits.append((entry['t'], entry['city'], entry['country']))
+                    else:
+                        self.responses[entry['key']].append(entry)
+        self.hits.sort()
+        self.by_path = defaultdict(list)
+        for key, entries in self.responses.items():
+            self.by_path[key.split('?', 1)[0]].extend(entries)
+
+
+class ReplayServer:
+    """
+    A local HTTP server answering upstream requests from a recording.
+
+    A GET is answered with the responses recorded for the same path and query in turn, or with any
+    response recorded for the path when that exact query was never seen (e.g. other coordinates).
+    POSTs, as sent by webhooks, are accepted with an empty JSON body. Every answer is delayed by
+    `latency_ms`, or by the recorded time multiplied by `latency_scale`, and a share `error_rate` of
+    them is replaced by an HTTP 503.
+    """
+
+    def __init__(self, recording: Recording, latency_ms: float | None = None, latency_scale: float = 1.0,
+                 error_rate: float = 0.0, seed=None, host: str = '127.0.0.1', port: int = 0):
+        self.recording = recording
+        self.latency_ms = latency_ms
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.address = (host, port)
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._turns = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, method: str, path: str) -> tuple[int, str, float]:
+        """
+        Picks the answer to a request.
+
+        Returns:
+            tuple: (HTTP status, body, delay in seconds).
+        """
+        key = recording_key(path)
+        route = key.split('?', 1)[0]
+        with self._lock:
+            self.calls[method, route] += 1
+            if method == 'POST':
+                status, body, ms = 200, '{}', 0.0
+            else:
+                entries = self.recording.responses.get(key) or self.recording.by_path.get(route)
+                if entries:
+                    entry = entries[self._turns[key] % len(entries)]
+                    self._turns[key] += 1
+                    status, body, ms = entry['status'], entry['body'], entry['ms'] * self.latency_scale
+                else:
+                    status, body, ms = 404, json.dumps({'message': 'not recorded'}), 0.0
+            if self._random.random() < self.error_rate:
+                status, body = 503, json.dumps({'message': 'injected error'})
+            if status >= 400:
+                self.errors[method, route] += 1
+        return status, body, (ms if self.latency_ms is None else self.latency_ms) / 1000
+
+    def upstream_calls(self) -> int:
+        return sum(count for (method, _), count in self.calls.items() if method == 'GET')
+
+    def __enter__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def answer(self, method):
+                if method == 'POST':
+                    self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, body, delay = server.respond(method, self.path)
+                time.sleep(delay)
+                payload = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.answer('GET')
+
+            def do_POST(self):
+                self.answer('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,19 +1,160 @@
-import os
-import requests
-from django.core.exceptions import ValidationError
+import atexit
+import datetime
+import logging
+import math
+import threading
+import time
 
-from dotenv import load_dotenv
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections
 
+from weather.live import get_broker
 from weather.models import City, WeatherRecord
+from weather.providers import ProviderError, get_providers
+
+logger = logging.getLogger(__name__)
+
+WEATHER_CACHE_SECONDS = 600
+WEATHER_FIELDS = ['temperature', 'feels_like', 'humidity', 'wind_speed', 'pressure']
+
+
+def weather_cache_key(city_id: int) -> str:
+    return f"weather:{city_id}"
 
-load_dotenv()
 
-API_KEY = os.getenv('API_KEY')
+def grid_cell(lat, lon) -> tuple[str, tuple[float, float]]:
+    """
+    Snaps coordinates to the WEATHER_GRID_DEGREES cell containing them.
+
+    Args:
+        lat: Latitude of the place.
+        lon: Longitude of the place.
+
+    Returns:
+        tuple: (cell id, (latitude, longitude) of the cell centre, where its weather is fetched).
+        With a grid size of 0 every distinct coordinate pair is its own cell.
+    """
+    size = settings.WEATHER_GRID_DEGREES
+    if size <= 0:
+        return f"{lat}:{lon}", (float(lat), float(lon))
+    row, col = math.floor(float(lat) / size), math.floor(float(lon) / size)
+    return f"{size}:{row}:{col}", (round((row + 0.5) * size, 6), round((col + 0.5) * size, 6))
+
+
+def cell_cache_key(cell: str) -> str:
+    return f"weather:cell:{cell}"
+
+
+# Concurrent misses on the same cell within a process wait for one fetch instead of each calling upstream.
+_cell_locks = [threading.Lock() for _ in range(64)]
+
+
+class WeatherRecordBuffer:
+    """
+    Coalesces WeatherRecord writes.
+
+    Observations are kept per city, so repeated refreshes of the same city within one window collapse
+    into a single row, and all pending cities are written with one INSERT ... ON CONFLICT DO UPDATE.
+    A flush happens when the batch is full or `flush_seconds` after the first pending write. A batch
+    that cannot be written is kept and retried with the next flush.
+    """
+
+    def __init__(self, flush_seconds: float, batch_size: int):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def add(self, city_id: int, observation: dict, recorded_at: datetime.datetime | None = None):
+        with self._lock:
+            self._pending[city_id] = {
+                **observation, 'recorded_at': recorded_at or datetime.datetime.now(datetime.timezone.utc)
+            }
+            flush_now = self.flush_seconds <= 0 or len(self._pending) >= self.batch_size
+            if not flush_now:
+                self._schedule()
+        if flush_now:
+            self.flush()
+
+    def _schedule(self):
+        """Starts the flush timer unless one is running. Called with the lock held."""
+        if self._timer is None and self.flush_seconds > 0:
+            self._timer = threading.Timer(self.flush_seconds, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # Every timer is a new thread with its own connections, which CONN_MAX_AGE would otherwise keep open.
+            connections.close_all()
+
+    def flush(self) -> int:
+        """
+        Writes all pending observations.
+
+        Returns:
+            int: The number of cities written, 0 if the write failed.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            records = WeatherRecord.objects.bulk_create(
+                [WeatherRecord(city_id=city_id, **observation) for city_id, observation in pending.items()],
+                update_conflicts=True,
+                unique_fields=['city'],
+                update_fields=WEATHER_FIELDS + ['recorded_at'],
+            )
+        except DatabaseError:
+            logger.exception("Could not write %d weather records, keeping them for the next flush", len(pending))
+            with self._lock:
+                # Observations added while the write was running are newer and win.
+                self._pending = {**pending, **self._pending}
+                self._schedule()
+            return 0
+        get_broker().publish_many([{'city_id': record.city_id, **pending[record.city_id]} for record in records])
+        return len(pending)
+
+
+weather_buffer = WeatherRecordBuffer(settings.WEATHER_FLUSH_SECONDS, settings.WEATHER_FLUSH_BATCH)
+atexit.register(weather_buffer.flush)
+
+
+def geocode_city(city_name: str, country_code: str) -> dict:
+    """
+    Look up a city by name and country code with the configured weather providers, without saving it.
+
+    Args:
+        city_name (str): Name of the city.
+        country_code (str): ISO country code.
+
+    Returns:
+        dict: City information containing name, country, latitude, and longitude.
+
+    Raises:
+        ValidationError: If every provider fails or the city is unknown.
+    """
+    try:
+        data = get_providers().geocode(city_name, country_code)
+    except ProviderError as e:
+        raise ValidationError({"error": "Weather service error", "details": str(e)})
+    if not data:
+        raise ValidationError({"error": "City not found", "details": f"City: {city_name}, Country code: {country_code}"})
+    return data
 
 
 def find_city(city_name: str, country_code: str) -> dict:
     """
-    Find a city by name and country code using the OpenWeatherMap Geocoding API.
+    Find a city by name and country code with the configured weather providers and store it.
 
     Args:
         city_name (str): Name of the city.
@@ -23,14 +164,7 @@ def find_city(city_name: str, country_code: str) -> dict:
         dict | None: City information containing name, country, latitude, and longitude
         if the request is successful. Otherwise, None.
     """
-    url = f'http://api.openweathermap.org/geo/1.0/direct?q={city_name},{country_code}&limit=1&appid={API_KEY}'
-    res = requests.get(url)
-    if res.status_code != 200:
-        raise ValidationError({"error": "Weather service error", "details": res.text})
-    data = res.json()
-    if not data:
-        raise ValidationError({"error": "City not found", "details": f"City: {city_name}, Country code: {country_code}"})
-    city_data = data[0]
+    city_data = geocode_city(city_name, country_code)
     City.objects.update_or_create(
         name=city_data["name"],
         country=city_data["country"],
@@ -42,9 +176,90 @@ def find_city(city_name: str, country_code: str) -> dict:
     return city_data
 
 
+def cached_weather(city: City) -> dict | None:
+    """
+    Return the latest weather for a city from the cache, without touching the database.
+
+    Args:
+        city (City): The city instance.
+
+    Returns:
+        dict | None: The weather result stored by `weather_city`, or None if nothing fresh is cached.
+    """
+    return cache.get(weather_cache_key(city.id))
+
+
+def weather_result(city: City, observation: dict) -> dict:
+    """Build the weather result returned by the API and the notification tasks."""
+    result = {'city': f"{city.name}, {city.country}"}
+    result.update({field: observation[field] for field in WEATHER_FIELDS})
+    return result
+
+
+def cache_weather(city: City, result: dict, timeout: float = WEATHER_CACHE_SECONDS):
+    """Make a weather result visible to readers for `timeout` seconds."""
+    if timeout >= 1:
+        cache.set(weather_cache_key(city.id), result, int(timeout))
+
+
+def record_weather(city: City, observation: dict, fetched_at: float | None = None) -> dict:
+    """
+    Publish an observation for a city: cache it right away and queue the WeatherRecord write.
+
+    Args:
+        city (City): The city the observation belongs to.
+        observation (dict): Values for WEATHER_FIELDS.
+        fetched_at (float | None): Timestamp of the upstream fetch, now if None. The result is cached for
+            what is left of WEATHER_CACHE_SECONDS after it, and the record is stamped with it.
+
+    Returns:
+        dict: The weather result in the shape returned by `weather_city`.
+    """
+    if fetched_at is None:
+        fetched_at = time.time()
+    result = weather_result(city, observation)
+    cache_weather(city, result, max(1, WEATHER_CACHE_SECONDS - (time.time() - fetched_at)))
+    weather_buffer.add(
+        city.id,
+        {field: observation[field] for field in WEATHER_FIELDS},
+        datetime.datetime.fromtimestamp(fetched_at, datetime.timezone.utc),
+    )
+    return result
+
+
+def cell_observation(lat, lon) -> tuple[dict, float]:
+    """
+    Returns the observation of the grid cell containing the coordinates, fetching it when the cell has none.
+
+    Each cell is fetched at most once per WEATHER_CACHE_SECONDS, whichever of its cities asks.
+
+    Returns:
+        tuple: (values for WEATHER_FIELDS, timestamp of the upstream fetch).
+
+    Raises:
+        ValidationError: If every provider fails.
+    """
+    cell, (cell_lat, cell_lon) = grid_cell(lat, lon)
+    key = cell_cache_key(cell)
+    with _cell_locks[hash(cell) % len(_cell_locks)]:
+        entry = cache.get(key)
+        if entry is None:
+            try:
+                observation = get_providers().current(cell_lat, cell_lon)
+            except ProviderError as e:
+                raise ValidationError({"error": "Weather service error", "details": str(e)})
+            entry = {'observation': observation, 'fetched_at': time.time()}
+            cache.set(key, entry, WEATHER_CACHE_SECONDS)
+    return entry['observation'], entry['fetched_at']
+
+
 def weather_city(city: City) -> dict | None:
     """
-    Retrieve the latest weather data for a given city using the OpenWeatherMap API.
+    Retrieve the latest weather data for a given city from the configured weather providers.
+
+    Cities in the same grid cell (see `grid_cell`) share one upstream fetch. Each of them gets a WeatherRecord
+    and a live update, stamped with the time of that fetch, and caches it for what is left of the cell's
+    WEATHER_CACHE_SECONDS, so the observation is never stored as newer than it is.
 
     Args:
         city (City): The city instance for which to retrieve weather.
@@ -53,37 +268,5 @@ def weather_city(city: City) -> dict | None:
         dict | None: Dictionary containing city name, temperature, feels-like temperature,
         humidity, wind speed, and pressure if successful. Otherwise, None.
     """
-    url = f"http://api.openweathermap.org/data/2.5/weather?lat={city.lat}&lon={city.lon}&units=metric&appid={API_KEY}"
-    res = requests.get(url)
-    if res.status_code != 200:
-        raise ValidationError({"error": "Weather service error", "details": res.text})
-
-    data = res.json()
-    if not data:
-        raise ValidationError({"error": "Weather not found", "details": f"{city}"})
-    temperature = data["main"]["temp"]
-    feels_like = data["main"]["feels_like"]
-    humidity = data["main"]["humidity"]
-    wind_speed = data["wind"]["speed"]
-    pressure = data["main"]["pressure"]
-
-    result = {
-        'city': f"{city.name}, {city.country}",
-        'temperature': temperature,
-        'feels_like': feels_like,
-        'humidity': humidity,
-        'wind_speed': wind_speed,
-        'pressure': pressure
-    }
-
-    WeatherRecord.objects.update_or_create(
-        city=city,
-        defaults={
-            "temperature": temperature,
-            "feels_like": feels_like,
-            "humidity": humidity,
-            "wind_speed": wind_speed,
-            "pressure": pressure,
-        }
-    )
-    return result
+    observation, fetched_at = cell_observation(city.lat, city.lon)
+    return record_weather(city, observation, fetched_at)
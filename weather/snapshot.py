@@ -0,0 +1,175 @@
+import mmap
+import os
+import struct
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from weather.models import City
+
+# Layout (little-endian): header, then ids, lat and lon in micro-degrees (int64 each), key and display
+# offsets (uint32, count + 1 each), then the key and display blobs. Keys are "name\0country" casefolded
+# and sorted, so a lookup is a binary search over the mapped file; displays are "name\0country" as stored.
+MAGIC = b'CITY'
+VERSION = 1
+HEADER = struct.Struct('<4sIIII')
+COORD_SCALE = 10 ** 6
+
+
+def snapshot_key(name: str, country: str) -> bytes:
+    return f"{name.strip().casefold()}\0{country.strip().casefold()}".encode()
+
+
+def build_city_snapshot(path: str | None = None) -> int:
+    """
+    Writes a snapshot of the City table and atomically replaces the previous one.
+
+    Args:
+        path (str | None): Target file, CITY_SNAPSHOT_PATH by default.
+
+    Returns:
+        int: The number of cities in the snapshot.
+    """
+    path = path or settings.CITY_SNAPSHOT_PATH
+    rows = sorted(
+        (snapshot_key(name, country), city_id, f"{name}\0{country}".encode(), lat, lon)
+        for city_id, name, country, lat, lon in City.objects.values_list('id', 'name', 'country', 'lat', 'lon').iterator()
+    )
+    count = len(rows)
+    keys = b''.join(row[0] for row in rows)
+    displays = b''.join(row[2] for row in rows)
+
+    def offsets(blobs):
+        result, position = [0], 0
+        for blob in blobs:
+            position += len(blob)
+            result.append(position)
+        return result
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, count, len(keys), len(displays)))
+        file.write(struct.pack(f'<{count}q', *(row[1] for row in rows)))
+        file.write(struct.pack(f'<{count}q', *(int(row[3] * COORD_SCALE) for row in rows)))
+        file.write(struct.pack(f'<{count}q', *(int(row[4] * COORD_SCALE) for row in rows)))
+        file.write(struct.pack(f'<{count + 1}I', *offsets(row[0] for row in rows)))
+        file.write(struct.pack(f'<{count + 1}I', *offsets(row[2] for row in rows)))
+        file.write(keys)
+        file.write(displays)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class CitySnapshot:
+    """A read-only, memory-mapped view of a snapshot file, shared through the page cache by every process."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, keys_size, _ = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a city snapshot: {path}")
+        self.ids_at = HEADER.size
+        self.lats_at = self.ids_at + 8 * self.count
+        self.lons_at = self.lats_at + 8 * self.count
+        self.key_offsets_at = self.lons_at + 8 * self.count
+        self.display_offsets_at = self.key_offsets_at + 4 * (self.count + 1)
+        self.keys_at = self.display_offsets_at + 4 * (self.count + 1)
+        self.displays_at = self.keys_at + keys_size
+
+    def _blob(self, offsets_at: int, blob_at: int, index: int) -> bytes:
+        start, end = struct.unpack_from('<II', self.buffer, offsets_at + 4 * index)
+        return self.buffer[blob_at + start:blob_at + end]
+
+    def lookup(self, name: str, country: str) -> City | None:
+        """Finds a city by case-insensitive name and country code with a binary search."""
+        key = snapshot_key(name, country)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._blob(self.key_offsets_at, self.keys_at, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self._blob(self.key_offsets_at, self.keys_at, low) != key:
+            return None
+
+        (city_id,) = struct.unpack_from('<q', self.buffer, self.ids_at + 8 * low)
+        (lat,) = struct.unpack_from('<q', self.buffer, self.lats_at + 8 * low)
+        (lon,) = struct.unpack_from('<q', self.buffer, self.lons_at + 8 * low)
+        city_name, city_country = self._blob(self.display_offsets_at, self.displays_at, low).decode().split('\0')
+        return City.from_db(
+            'default', ['id', 'name', 'country', 'lat', 'lon'],
+            [city_id, city_name, city_country, Decimal(lat).scaleb(-6), Decimal(lon).scaleb(-6)],
+        )
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def current_snapshot() -> CitySnapshot | None:
+    """
+    Returns the mapped snapshot of this process, remapping it when the file has been replaced.
+
+    A missing snapshot is built once; None is returned when snapshots are disabled (CITY_SNAPSHOT_PATH unset).
+    """
+    global _snapshot
+    path = settings.CITY_SNAPSHOT_PATH
+    if not path:
+        return None
+    with _snapshot_lock:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            build_city_snapshot(path)
+            stat = os.stat(path)
+        if _snapshot is None or (_snapshot.stat.st_ino, _snapshot.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            _snapshot = CitySnapshot(path)
+        return _snapshot
+
+
+def lookup_city(city_name: str, country_code: str) -> City | None:
+    """
+    Resolves a city by case-insensitive name and country code, from the snapshot when possible.
+
+    Cities missing from the snapshot (e.g. added through the admin since the last rebuild) are looked up
+    in the database.
+
+    Args:
+        city_name (str): Name of the city.
+        country_code (str): ISO country code.
+
+    Returns:
+        City or None: The city, if it is known locally.
+    """
+    snapshot = current_snapshot()
+    city = snapshot.lookup(city_name, country_code) if snapshot else None
+    if city is None:
+        city = City.objects.filter(name__iexact=city_name, country__iexact=country_code).first()
+    return city
+
+
+def rebuild_city_snapshot():
+    """
+    Rebuilds the snapshot after cities changed, if snapshots are enabled.
+
+    Saves and deletions of single cities trigger it through signals; code changing cities in bulk
+    (`bulk_create`, `QuerySet.update`) calls it itself. Both defer it with `transaction.on_commit`, so
+    cities of a transaction that is rolled back are never published.
+    """
+    if settings.CITY_SNAPSHOT_PATH:
+        build_city_snapshot()
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def city_changed(sender, **kwargs):
+    transaction.on_commit(rebuild_city_snapshot)
@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from weather.forecasts import refresh_forecasts
+from weather.models import City
+
+FORECAST_BATCH = 100
+
+
+@shared_task
+def refresh_subscribed_forecasts():
+    """Refreshes the stored forecasts of every city that has at least one subscription."""
+    city_ids = list(City.objects.filter(subscriptions__isnull=False).distinct().values_list('id', flat=True))
+    for start in range(0, len(city_ids), FORECAST_BATCH):
+        refresh_forecasts(list(City.objects.filter(id__in=city_ids[start:start + FORECAST_BATCH])))
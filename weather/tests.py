@@ -1,9 +1,40 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch, MagicMock
+
+import fakeredis
+from celery.signals import worker_process_shutdown
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-from users.models import User
-from weather.models import City, WeatherRecord
+from DjangoWeatherReminder.profiling import query_budget
+from users.models import User, Subscription, NotificationDelivery
+from weather.forecasts import refresh_forecasts
+from weather.live import LIVE_PATH, RedisBroker, get_broker, live_weather_app
+from weather.models import City, Forecast, WeatherRecord
+from weather.providers import (
+    LATENCY_MIN_SAMPLES, OpenMeteoProvider, ProviderChain, ProviderError, WeatherProvider, get_providers
+)
+from weather.replay import Recording, ReplayServer, UpstreamRecorder, record_hit
+from weather.services import (
+    WeatherRecordBuffer, cached_weather, cache_weather, find_city, grid_cell, weather_city
+)
+from weather.snapshot import build_city_snapshot, current_snapshot, lookup_city, rebuild_city_snapshot
+from weather.views import CityWeatherByNameView
 
 
 class CityModelTest(TestCase):
@@ -48,6 +79,33 @@ class CityViewSetTest(APITestCase):
         self.assertEqual(len(response.data), 2)
 
 
+class ExportViewTest(APITestCase):
+    def setUp(self):
+        City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        City.objects.create(name="Lviv", country="UA", lat=49.84, lon=24.03)
+
+    def test_export_cities_ndjson(self):
+        """Cities are streamed as one JSON object per line."""
+        response = self.client.get(reverse('export-cities'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["name"] for row in rows], ["Kyiv", "Lviv"])
+        self.assertEqual(rows[0]["lat"], "50.450000")
+
+    def test_export_cities_csv(self):
+        """Cities are streamed as CSV with a header row."""
+        response = self.client.get(reverse('export-cities'), {"output": "csv"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ["id", "name", "country", "lat", "lon"])
+        self.assertEqual(len(rows), 3)
+
+    def test_export_unknown_format(self):
+        response = self.client.get(reverse('export-cities'), {"output": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+
 class CityWeatherByNameViewTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -61,6 +119,7 @@ class CityWeatherByNameViewTest(APITestCase):
             "password": "Bt41BBT103"
         })
         self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        cache.clear()
         self.city = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
         self.weather = WeatherRecord.objects.create(
             city=self.city,
@@ -74,8 +133,519 @@ class CityWeatherByNameViewTest(APITestCase):
     def test_get_weather(self):
         """Test that the CityWeatherByNameView returns correct weather data for a city."""
         url = reverse('city-weather-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
-        response = self.client.get(url)
+        with query_budget(self, CityWeatherByNameView.query_budget):
+            response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["temperature"], 25.0)
         self.assertEqual(response.data["humidity"], 50)
         self.assertEqual(response.data["wind_speed"], 5.0)
+
+    def test_get_cached_weather_without_user_lookup(self):
+        """With cached weather the view only resolves the city; the JWT user is built from the token."""
+        cache_weather(self.city, {"city": "Kyiv, UA", "temperature": 19.0})
+        url = reverse('city-weather-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.data["temperature"], 19.0)
+
+    @patch("weather.providers.requests.get")
+    def test_fetch_within_budget(self, mock_get):
+        """A stale record is refreshed from the upstream within the declared query budget."""
+        mock_get.return_value = upstream_weather(12.0)
+        stale = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        WeatherRecord.objects.filter(pk=self.weather.pk).update(recorded_at=stale)
+        url = reverse('city-weather-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
+        with query_budget(self, CityWeatherByNameView.query_budget):
+            response = self.client.get(url)
+        self.assertEqual(response.data["temperature"], 12.0)
+
+
+def upstream_weather(temperature=20.0):
+    """Build a mocked OpenWeatherMap current weather response."""
+    return MagicMock(status_code=200, json=MagicMock(return_value={
+        "main": {"temp": temperature, "feels_like": temperature - 1, "humidity": 40, "pressure": 1010},
+        "wind": {"speed": 3.0},
+    }))
+
+
+class WeatherRecordBufferTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        self.lviv = City.objects.create(name="Lviv", country="UA", lat=49.84, lon=24.03)
+
+    def observation(self, temperature):
+        return {"temperature": temperature, "feels_like": temperature, "humidity": 40, "wind_speed": 3.0,
+                "pressure": 1010}
+
+    def test_writes_are_coalesced(self):
+        """Repeated observations of a city are written once, with the latest values, in one flush."""
+        buffer = WeatherRecordBuffer(flush_seconds=3600, batch_size=100)
+        buffer.add(self.kyiv.id, self.observation(10))
+        buffer.add(self.kyiv.id, self.observation(12))
+        buffer.add(self.lviv.id, self.observation(8))
+        self.assertFalse(WeatherRecord.objects.exists())
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(WeatherRecord.objects.get(city=self.kyiv).temperature, 12)
+
+        buffer.add(self.kyiv.id, self.observation(14))
+        buffer.flush()
+        self.assertEqual(WeatherRecord.objects.filter(city=self.kyiv).count(), 1)
+        self.assertEqual(WeatherRecord.objects.get(city=self.kyiv).temperature, 14)
+
+    def test_failed_write_is_retried(self):
+        """A batch that could not be written stays buffered; newer observations win over it."""
+        buffer = WeatherRecordBuffer(flush_seconds=3600, batch_size=100)
+        buffer.add(self.kyiv.id, self.observation(10))
+        buffer.add(self.lviv.id, self.observation(8))
+        with patch.object(WeatherRecord.objects, "bulk_create", side_effect=OperationalError("database is down")), \
+                self.assertLogs("weather.services", level="ERROR"):
+            self.assertEqual(buffer.flush(), 0)
+        buffer.add(self.kyiv.id, self.observation(12))
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(WeatherRecord.objects.get(city=self.kyiv).temperature, 12)
+        self.assertEqual(WeatherRecord.objects.get(city=self.lviv).temperature, 8)
+
+    def test_timer_flush_closes_its_connection(self):
+        """The connection opened by a timer thread is closed even within CONN_MAX_AGE."""
+        buffer = WeatherRecordBuffer(flush_seconds=3600, batch_size=100)
+        with patch.object(buffer, "flush") as flush, patch("weather.services.connections") as connections:
+            buffer._flush_from_timer()
+        flush.assert_called_once_with()
+        connections.close_all.assert_called_once_with()
+
+    @patch("weather.services.weather_buffer", WeatherRecordBuffer(flush_seconds=3600, batch_size=100))
+    @patch("weather.providers.requests.get", return_value=upstream_weather(21.5))
+    def test_fetched_weather_is_cached_before_flush(self, mock_get):
+        """A fetched observation is readable from the cache before it reaches the database."""
+        weather_city(self.kyiv)
+        self.assertFalse(WeatherRecord.objects.exists())
+        self.assertEqual(cached_weather(self.kyiv)["temperature"], 21.5)
+
+
+class StubUpstream:
+    """A local HTTP server answering upstream requests with canned JSON, keyed by path."""
+
+    def __init__(self, responses: dict):
+        self.responses = responses
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                stub.requests.append(self.path)
+                body = json.dumps(stub.responses.get(path, {})).encode()
+                self.send_response(200 if path in stub.responses else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.patcher = override_settings(OPENWEATHER_URL=self.url)
+        self.patcher.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.patcher.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def upstream_forecast(start: int, steps: int, rain_at: int):
+    """Build an OpenWeatherMap 5 day / 3 hour forecast with rain at one step."""
+    return {"list": [
+        {
+            "dt": start + i * 10800,
+            "main": {"temp": 10.0 + i, "humidity": 50},
+            "pop": 0.9 if i == rain_at else 0.1,
+            **({"rain": {"3h": 2.5}} if i == rain_at else {}),
+        }
+        for i in range(steps)
+    ]}
+
+
+class ForecastTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='IvanTest', email='ivan@testovich.com', password='Bt41BBT103')
+        self.client.force_authenticate(self.user)
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        Subscription.objects.create(user=self.user, city=self.kyiv)
+        self.start = int(time.time()) // 10800 * 10800 + 10800
+
+    def test_refresh_and_query_forecast(self):
+        """Forecasts are pulled from the upstream stub once and answered from local data."""
+        with StubUpstream({"/data/2.5/forecast": upstream_forecast(self.start, 40, rain_at=10)}) as upstream:
+            self.assertEqual(refresh_forecasts([self.kyiv]), 1)
+            self.assertEqual(refresh_forecasts([self.kyiv]), 1)
+            self.assertEqual(Forecast.objects.filter(city=self.kyiv).count(), 1)
+
+            url = reverse('city-forecast-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
+            response = self.client.get(url, {"hours": 24})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["steps"]), 8)
+            self.assertEqual(response.data["steps"][0]["temperature"], 10.0)
+            self.assertFalse(response.data["will_rain"])
+
+            response = self.client.get(reverse('forecast-summary'), {"hours": 48})
+            self.assertTrue(response.data[0]["will_rain"])
+            self.assertEqual(response.data[0]["total_precipitation"], 2.5)
+            self.assertEqual(len(upstream.requests), 2)
+
+    def test_gap_in_forecast(self):
+        """Steps missing from the upstream series are returned as nulls."""
+        forecast = upstream_forecast(self.start, 8, rain_at=5)
+        del forecast["list"][3]
+        with StubUpstream({"/data/2.5/forecast": forecast}):
+            refresh_forecasts([self.kyiv])
+        url = reverse('city-forecast-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
+        response = self.client.get(url, {"hours": 24})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["steps"][3]["humidity"], None)
+        self.assertEqual(response.data["steps"][3]["temperature"], None)
+        self.assertEqual(response.data["steps"][4]["temperature"], 14.0)
+        self.assertEqual(response.data["min_temperature"], 10.0)
+
+    def test_malformed_forecast_is_skipped(self):
+        """A forecast that cannot be laid out fails its own fetch, not the whole refresh."""
+        duplicate = upstream_forecast(self.start, 8, rain_at=5)
+        duplicate["list"][1]["dt"] = duplicate["list"][0]["dt"]
+        without_main = upstream_forecast(self.start, 8, rain_at=5)
+        del without_main["list"][2]["main"]
+        for forecast in (duplicate, without_main, {"list": "unavailable"}):
+            with self.subTest(forecast=str(forecast)[:40]), StubUpstream({"/data/2.5/forecast": forecast}):
+                self.assertEqual(refresh_forecasts([self.kyiv]), 0)
+        self.assertFalse(Forecast.objects.exists())
+
+    def test_forecast_not_available(self):
+        url = reverse('city-forecast-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class LiveWeatherTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='IvanTest', email='ivan@testovich.com', password='Bt41BBT103')
+        self.token = str(AccessToken.for_user(self.user))
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+
+    def stream(self, query: str, publish=(), headers=()):
+        """Runs the SSE app until the client disconnects and returns the status and the body chunks."""
+        async def scenario():
+            sent = []
+            incoming = asyncio.Queue()
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'path': LIVE_PATH, 'query_string': query.encode(), 'headers': list(headers)}
+            app = asyncio.ensure_future(live_weather_app(scope, incoming.get, send))
+            await asyncio.sleep(0.05)
+            get_broker().publish_many(list(publish))
+            await asyncio.sleep(0.05)
+            await incoming.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(app, 1)
+            return sent[0]['status'], [message.get('body', b'') for message in sent[1:]]
+
+        return asyncio.run(scenario())
+
+    def test_updates_are_pushed_for_subscribed_cities(self):
+        """Only updates of the requested cities reach the stream."""
+        status, chunks = self.stream(
+            f"cities={self.kyiv.id}",
+            headers=[(b"authorization", f"Bearer {self.token}".encode())],
+            publish=[{"city_id": self.kyiv.id, "temperature": 21.0}, {"city_id": self.kyiv.id + 1, "temperature": 5.0}],
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith(b"event: weather\ndata: "))
+        self.assertEqual(json.loads(chunks[0].split(b"data: ")[1])["temperature"], 21.0)
+
+    def test_stream_requires_token(self):
+        status, _ = self.stream(f"cities={self.kyiv.id}", headers=[(b"authorization", b"Bearer invalid")])
+        self.assertEqual(status, 401)
+        status, _ = self.stream(f"cities={self.kyiv.id}&token={self.token}")
+        self.assertEqual(status, 401)
+
+    def test_ticket_opens_one_stream(self):
+        """EventSource clients authenticate with a single-use ticket instead of a token in the URL."""
+        response = self.client.post(reverse('live-ticket'), HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        ticket = response.json()["ticket"]
+        self.assertEqual(self.stream(f"cities={self.kyiv.id}&ticket={ticket}")[0], 200)
+        self.assertEqual(self.stream(f"cities={self.kyiv.id}&ticket={ticket}")[0], 401)
+
+    @patch("weather.live.LIVE_RECONNECT_SECONDS", 0.01)
+    def test_redis_listener_reconnects(self):
+        """The Redis listener logs a lost connection and resubscribes, so open streams keep receiving updates."""
+        server = fakeredis.FakeServer()
+        server.connected = False
+
+        async def scenario():
+            with patch("redis.Redis.from_url", return_value=fakeredis.FakeRedis(server=server)), \
+                    patch("redis.asyncio.Redis.from_url", side_effect=lambda url: fakeredis.FakeAsyncRedis(server=server)):
+                broker = RedisBroker("redis://localhost/2")
+                with broker.subscribe({self.kyiv.id}) as queue:
+                    await asyncio.sleep(0.05)
+                    server.connected = True
+                    await asyncio.sleep(0.1)
+                    broker.publish_many([{"city_id": self.kyiv.id, "temperature": 7.0}])
+                    update = await asyncio.wait_for(queue.get(), 1)
+                broker._listener.cancel()
+            return json.loads(update)
+
+        with self.assertLogs("weather.live", level="WARNING"):
+            self.assertEqual(asyncio.run(scenario())["temperature"], 7.0)
+
+    def test_flush_publishes_written_records(self):
+        """Every WeatherRecord written by a flush is published to the broker."""
+        buffer = WeatherRecordBuffer(flush_seconds=3600, batch_size=100)
+        buffer.add(self.kyiv.id, {"temperature": 3.0, "feels_like": 1.0, "humidity": 80, "wind_speed": 4.0,
+                                  "pressure": 1000})
+        with patch.object(get_broker(), 'publish_many') as publish:
+            buffer.flush()
+        message = publish.call_args.args[0][0]
+        self.assertEqual(message["city_id"], self.kyiv.id)
+        self.assertEqual(message["temperature"], 3.0)
+        self.assertIn("recorded_at", message)
+
+
+class CitySnapshotTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(CITY_SNAPSHOT_PATH=os.path.join(directory.name, 'cities.bin'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        City.objects.create(name="Lviv", country="UA", lat=49.8397, lon=24.0297)
+        self.assertEqual(build_city_snapshot(), 2)
+
+    def test_lookup_without_queries(self):
+        """Known cities are resolved case-insensitively from the mapped file."""
+        with self.assertNumQueries(0):
+            city = lookup_city("kyiv", "ua")
+            self.assertIsNone(current_snapshot().lookup("Odesa", "UA"))
+        self.assertEqual(city.id, self.kyiv.id)
+        self.assertEqual((city.name, city.country), ("Kyiv", "UA"))
+        self.assertAlmostEqual(float(city.lat), 50.45)
+        self.assertAlmostEqual(float(city.lon), 30.523)
+
+    def test_missing_city_falls_back_to_database(self):
+        [odesa] = City.objects.bulk_create([City(name="Odesa", country="UA", lat=46.4825, lon=30.7233)])
+        with self.assertNumQueries(1):
+            self.assertEqual(lookup_city("Odesa", "UA").id, odesa.id)
+        self.assertIsNone(lookup_city("Nowhere", "UA"))
+
+    def test_changed_cities_are_not_served(self):
+        """Renamed and deleted cities leave the snapshot with them."""
+        City.objects.filter(name="Lviv").update(name="Lemberg")
+        lemberg = City.objects.get(name="Lemberg")
+        lemberg.name = "Lviv"
+        with self.captureOnCommitCallbacks(execute=True):
+            lemberg.save()
+            self.kyiv.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_city("lviv", "UA").id, lemberg.id)
+        self.assertIsNone(lookup_city("Kyiv", "UA"))
+
+    @patch("weather.services.geocode_city")
+    def test_geocoded_city_rebuilds_snapshot(self, mock_geocode):
+        mock_geocode.return_value = {"name": "Odesa", "country": "UA", "lat": 46.4825, "lon": 30.7233}
+        with self.captureOnCommitCallbacks(execute=True):
+            find_city("Odesa", "UA")
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(lookup_city("odesa", "UA"))
+
+    def test_uncommitted_cities_are_not_served(self):
+        """The snapshot is rebuilt once the transaction saving a city commits, not before."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            City.objects.create(name="Odesa", country="UA", lat=46.4825, lon=30.7233)
+            self.assertIsNone(current_snapshot().lookup("Odesa", "UA"))
+        self.assertEqual(callbacks, [rebuild_city_snapshot])
+
+
+class StubProvider(WeatherProvider):
+    """A provider answering with a fixed temperature after `delay` seconds, or failing."""
+
+    def __init__(self, name: str, temperature: float = 20.0, delay: float = 0.0, fail: bool = False):
+        super().__init__()
+        self.name = name
+        self.temperature = temperature
+        self.delay = delay
+        self.fail = fail
+
+    def current(self, lat, lon) -> dict:
+        time.sleep(self.delay)
+        if self.fail:
+            raise ProviderError(f"{self.name}: down")
+        return {"temperature": self.temperature, "feels_like": self.temperature, "humidity": 50,
+                "wind_speed": 2.0, "pressure": 1010}
+
+
+class ProviderChainTest(TestCase):
+    def test_failover(self):
+        """A failing primary is replaced by the backup and skipped while it cools down."""
+        chain = ProviderChain([StubProvider("primary", fail=True), StubProvider("backup", temperature=7.0)])
+        self.assertEqual(chain.current(50.45, 30.52)["temperature"], 7.0)
+        self.assertEqual([provider.name for provider in chain.ordered()], ["backup", "primary"])
+        self.assertEqual(chain.providers[0].stats()["failures"], 1)
+
+    def test_slow_primary_is_hedged(self):
+        """A request slower than the primary's p95 is also sent to the backup, and the first answer wins."""
+        primary = StubProvider("primary", temperature=1.0, delay=0.5)
+        for _ in range(LATENCY_MIN_SAMPLES):
+            primary.latency.add(0.01)
+        chain = ProviderChain([primary, StubProvider("backup", temperature=2.0)])
+        started = time.perf_counter()
+        self.assertEqual(chain.current(50.45, 30.52)["temperature"], 2.0)
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual(chain.hedged, 1)
+
+    def test_all_providers_fail(self):
+        chain = ProviderChain([StubProvider("primary", fail=True), StubProvider("backup", fail=True)])
+        with self.assertRaisesMessage(ProviderError, "primary: down"):
+            chain.current(50.45, 30.52)
+
+    def test_weather_city_falls_back(self):
+        """weather_city returns the usual result shape whichever provider answered."""
+        cache.clear()
+        city = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        chain = ProviderChain([StubProvider("primary", fail=True), StubProvider("backup", temperature=4.0)])
+        with patch("weather.services.get_providers", return_value=chain):
+            result = weather_city(city)
+        self.assertEqual(result["city"], "Kyiv, UA")
+        self.assertEqual(result["temperature"], 4.0)
+
+    @override_settings(WEATHER_PROVIDERS=["openweathermap", "open-meteo"])
+    def test_configured_providers(self):
+        self.assertEqual([provider.name for provider in get_providers().providers], ["openweathermap", "open-meteo"])
+
+    def test_open_meteo_is_normalized(self):
+        responses = {
+            "/v1/forecast": {"current": {"temperature_2m": 11.5, "apparent_temperature": 9.8,
+                                         "relative_humidity_2m": 71, "wind_speed_10m": 3.4, "pressure_msl": 1016.2}},
+            "/v1/search": {"results": [{"name": "Kyiv", "country_code": "UA", "latitude": 50.45, "longitude": 30.52}]},
+        }
+        with StubUpstream(responses) as stub:
+            provider = OpenMeteoProvider(stub.url, stub.url)
+            self.assertEqual(provider.current(50.45, 30.52), {
+                "temperature": 11.5, "feels_like": 9.8, "humidity": 71, "wind_speed": 3.4, "pressure": 1016.2,
+            })
+            self.assertEqual(provider.geocode("Kyiv", "UA"), {"name": "Kyiv", "country": "UA", "lat": 50.45, "lon": 30.52})
+
+
+class GridCellTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.chain = ProviderChain([StubProvider("primary", temperature=6.0)])
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.4501, lon=30.5234)
+        self.podil = City.objects.create(name="Podil", country="UA", lat=50.4612, lon=30.5301)
+        self.lviv = City.objects.create(name="Lviv", country="UA", lat=49.84, lon=24.03)
+
+    def test_nearby_cities_share_a_fetch(self):
+        """Cities in one grid cell cost one upstream call; a city elsewhere gets its own."""
+        with patch("weather.services.get_providers", return_value=self.chain):
+            self.assertEqual(weather_city(self.kyiv)["temperature"], 6.0)
+            self.assertEqual(weather_city(self.podil)["temperature"], 6.0)
+            self.assertEqual(self.chain.providers[0].calls, 1)
+            weather_city(self.lviv)
+            self.assertEqual(self.chain.providers[0].calls, 2)
+        self.assertEqual(cached_weather(self.podil)["city"], "Podil, UA")
+        kyiv, podil = (WeatherRecord.objects.get(city=city) for city in (self.kyiv, self.podil))
+        self.assertEqual(podil.temperature, 6.0)
+        self.assertEqual(podil.recorded_at, kyiv.recorded_at)
+
+    @override_settings(WEATHER_GRID_DEGREES=0)
+    def test_grid_disabled(self):
+        """With a grid size of 0 only identical coordinates share a fetch."""
+        self.assertEqual(grid_cell(50.45, 30.52)[1], (50.45, 30.52))
+        with patch("weather.services.get_providers", return_value=self.chain):
+            weather_city(self.kyiv)
+            weather_city(self.podil)
+        self.assertEqual(self.chain.providers[0].calls, 2)
+
+    def test_forecasts_are_fetched_per_cell(self):
+        start = int(time.time()) // 10800 * 10800 + 10800
+        with StubUpstream({"/data/2.5/forecast": upstream_forecast(start, 8, rain_at=2)}) as upstream:
+            self.assertEqual(refresh_forecasts([self.kyiv, self.podil, self.lviv]), 3)
+            self.assertEqual(len(upstream.requests), 2)
+        self.assertEqual(Forecast.objects.count(), 3)
+
+
+class ReplayTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.kyiv = City.objects.create(name="Kyiv", country="UA", lat=50.45, lon=30.523)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "upstream.jsonl.gz")
+        self.body = upstream_weather(12.0).json()
+
+    def test_record_and_replay(self):
+        """Hits and upstream responses are recorded without the API key and served back by the stub."""
+        user = User.objects.create_user(username='IvanTest', email='ivan@testovich.com', password='Bt41BBT103')
+        self.client.force_authenticate(user)
+        url = reverse('city-weather-by-name', kwargs={"city_name": "Kyiv", "country_code": "UA"})
+        with StubUpstream({"/data/2.5/weather": self.body}), \
+                override_settings(UPSTREAM_RECORD_PATH=self.path, API_KEY="secret"):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        recording = Recording(self.path)
+        self.assertEqual(recording.hits[0][1:], ("Kyiv", "UA"))
+        [key] = recording.responses
+        self.assertTrue(key.startswith("/data/2.5/weather?lat="))
+        self.assertNotIn("secret", key)
+
+        lviv = City.objects.create(name="Lviv", country="UA", lat=49.84, lon=24.03)
+        with ReplayServer(recording, latency_ms=0) as replay, override_settings(OPENWEATHER_URL=replay.url):
+            cache.clear()
+            self.assertEqual(weather_city(lviv)["temperature"], 12.0)
+        with ReplayServer(recording, latency_ms=0, error_rate=1.0) as replay, override_settings(OPENWEATHER_URL=replay.url):
+            cache.clear()
+            with self.assertRaises(ValidationError):
+                weather_city(self.kyiv)
+            self.assertEqual(replay.errors["GET", "/data/2.5/weather"], 1)
+
+    def test_worker_child_flushes_recording(self):
+        """Celery children exit without atexit handlers, so their shutdown signal writes the pending entries."""
+        with override_settings(UPSTREAM_RECORD_PATH=self.path):
+            record_hit("Kyiv", "UA")
+            self.assertFalse(os.path.exists(self.path))
+            worker_process_shutdown.send(sender=None, pid=os.getpid(), exitcode=0)
+            self.assertEqual(Recording(self.path).hits[0][1:], ("Kyiv", "UA"))
+
+    def test_replay_day(self):
+        """A recorded day is driven through the view and the notification task, and rolled back."""
+        start = time.time() - 86400
+        recorder = UpstreamRecorder(self.path)
+        recorder.add({"kind": "upstream", "t": start, "key": "/data/2.5/weather", "status": 200, "ms": 1.0,
+                      "body": json.dumps(self.body)})
+        for offset in (0, 60, 1200):
+            recorder.add({"kind": "hit", "t": start + offset, "city": "Kyiv", "country": "UA"})
+        recorder.flush()
+        user = User.objects.create_user(username='IvanTest', email='ivan@testovich.com', password='Bt41BBT103')
+        next_send_at = datetime.datetime.fromtimestamp(start + 30, datetime.timezone.utc)
+        Subscription.objects.create(user=user, city=self.kyiv, next_send_at=next_send_at)
+
+        out = io.StringIO()
+        call_command("replay_day", self.path, "--hours", "1", "--latency-ms", "0", stdout=out)
+        # Cached for 10 minutes of replayed time: the hit after 20 minutes fetches again.
+        self.assertIn("Upstream calls: 2 for 4 weather lookups, 2 saved (50.0%)", out.getvalue())
+        self.assertIn("Notifications: 1 sent", out.getvalue())
+        self.assertFalse(NotificationDelivery.objects.exists())
+        self.assertFalse(WeatherRecord.objects.exists())
+
+        out = io.StringIO()
+        call_command("replay_day", self.path, "--hours", "1", "--latency-ms", "0", "--error-rate", "1", "--seed", "1",
+                     stdout=out)
+        self.assertIn("statuses {500: 3}", out.getvalue())
+        self.assertIn("Notifications: 0 sent", out.getvalue())
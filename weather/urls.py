@@ -1,7 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from weather.views import CityViewSet, CityWeatherByNameView
+from weather.views import (
+    CityViewSet, CityWeatherByNameView, CityExportView, WeatherRecordExportView, CityForecastView, ForecastSummaryView,
+    LiveTicketView
+)
 
 router = DefaultRouter()
 router.register('cities', CityViewSet, basename='city')
@@ -10,4 +13,10 @@ urlpatterns = [
     path('', include(router.urls)),
     path("cities/<str:city_name>/<str:country_code>/weather/", CityWeatherByNameView.as_view(),
          name="city-weather-by-name"),
+    path("cities/<str:city_name>/<str:country_code>/forecast/", CityForecastView.as_view(),
+         name="city-forecast-by-name"),
+    path("forecast/", ForecastSummaryView.as_view(), name="forecast-summary"),
+    path("export/cities/", CityExportView.as_view(), name="export-cities"),
+    path("export/weather/", WeatherRecordExportView.as_view(), name="export-weather"),
+    path("live/ticket/", LiveTicketView.as_view(), name="live-ticket"),
 ]
@@ -1,13 +1,21 @@
 from datetime import datetime, timezone
+from django.db.models import F
 from rest_framework import permissions, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from users.authentication import STATELESS_AUTHENTICATION_CLASSES
+from weather.exports import export_response
+from weather.forecasts import latest_forecasts, forecast_window, rounded, summarize_window
+from weather.live import LIVE_TICKET_SECONDS, issue_ticket
 from weather.models import City, WeatherRecord
+from weather.replay import record_hit
 from weather.serializers import CitySerializer
-from weather.services import find_city, weather_city
-
-WEATHER_CACHE_SECONDS = 600
+from weather.services import (
+    find_city, weather_city, cached_weather, cache_weather, weather_result, WEATHER_CACHE_SECONDS, WEATHER_FIELDS
+)
+from weather.snapshot import lookup_city
 
 
 class CityViewSet(viewsets.ReadOnlyModelViewSet):
@@ -15,10 +23,13 @@ class CityViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = City.objects.all().order_by('name')
     serializer_class = CitySerializer
     permission_classes = [permissions.AllowAny]
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
 
 
 class CityWeatherByNameView(APIView):
     """An API view to get the latest weather information for a city by its name and country code."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    query_budget = 3
 
     def get(self, request, city_name: str, country_code: str):
         """
@@ -29,21 +40,135 @@ class CityWeatherByNameView(APIView):
             city_name (str): Name of the city.
             country_code (str): ISO country code.
         """
-        city = City.objects.filter(name__iexact=city_name, country__iexact=country_code).first()
+        record_hit(city_name, country_code)
+        city = lookup_city(city_name, country_code)
         if not city:
             city_data = find_city(city_name, country_code)
             city = City.objects.filter(name=city_data["name"], country=city_data["country"]).first()
 
+        result = cached_weather(city)
+        if result:
+            return Response(result)
+
         weather = WeatherRecord.objects.filter(city=city).first()
         now_dt = datetime.now(timezone.utc)
-        if weather and (now_dt - weather.recorded_at).total_seconds() < WEATHER_CACHE_SECONDS:
-            return Response({
-                "city": f"{city.name}, {city.country}",
-                "temperature": weather.temperature,
-                "feels_like": weather.feels_like,
-                "humidity": weather.humidity,
-                "wind_speed": weather.wind_speed,
-                "pressure": weather.pressure,
-            })
+        if weather:
+            age = (now_dt - weather.recorded_at).total_seconds()
+            if age < WEATHER_CACHE_SECONDS:
+                result = weather_result(city, {field: getattr(weather, field) for field in WEATHER_FIELDS})
+                cache_weather(city, result, WEATHER_CACHE_SECONDS - age)
+                return Response(result)
         result = weather_city(city)
         return Response(result)
+
+
+class CityExportView(APIView):
+    """Streams all cities as NDJSON (default) or CSV, selected with ``?output=csv``."""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+
+    def get(self, request):
+        return export_response(
+            request, City.objects.order_by('id'), ['id', 'name', 'country', 'lat', 'lon'], 'cities'
+        )
+
+
+class WeatherRecordExportView(APIView):
+    """Streams the latest stored weather of every city as NDJSON (default) or CSV, selected with ``?output=csv``."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+
+    def get(self, request):
+        return export_response(
+            request,
+            WeatherRecord.objects.order_by('id'),
+            ['city_id', 'temperature', 'feels_like', 'humidity', 'wind_speed', 'pressure', 'recorded_at'],
+            'weather',
+            city_name=F('city__name'),
+            country=F('city__country'),
+        )
+
+
+FORECAST_MAX_HOURS = 120
+
+
+def forecast_hours(request) -> int:
+    """Reads the ``hours`` query parameter (default 24) of a forecast request."""
+    try:
+        hours = int(request.query_params.get('hours', 24))
+    except ValueError:
+        raise ValidationError({"hours": "Must be an integer."})
+    return max(1, min(hours, FORECAST_MAX_HOURS))
+
+
+class CityForecastView(APIView):
+    """An API view to get the stored forecast of a city for the next hours, answered from local data only."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    query_budget = 2
+
+    def get(self, request, city_name: str, country_code: str):
+        """
+        Retrieve the forecast of a city, step by step, with a summary.
+
+        Args:
+            request: The HTTP request object, with an optional ``hours`` query parameter (default 24).
+            city_name (str): Name of the city.
+            country_code (str): ISO country code.
+        """
+        hours = forecast_hours(request)
+        city = lookup_city(city_name, country_code)
+        forecast = latest_forecasts([city.id]).get(city.id) if city else None
+        if not forecast:
+            return Response({"error": "Forecast not available"}, status=404)
+
+        window = forecast_window(forecast, datetime.now(timezone.utc), hours)
+        return Response({
+            "city": f"{city.name}, {city.country}",
+            "run_at": forecast.run_at,
+            **summarize_window(window),
+            "steps": [
+                {
+                    "time": time,
+                    "temperature": rounded(temperature, 2),
+                    "humidity": rounded(humidity),
+                    "precipitation_probability": rounded(probability, 2),
+                    "precipitation": rounded(precipitation, 2),
+                }
+                for time, temperature, humidity, probability, precipitation in zip(
+                    window["times"], window["temperature"], window["humidity"],
+                    window["precipitation_probability"], window["precipitation"],
+                )
+            ],
+        })
+
+
+class LiveTicketView(APIView):
+    """Issues a short-lived, single-use ticket for opening the live weather stream from a browser EventSource."""
+
+    def post(self, request):
+        return Response({"ticket": issue_ticket(request.user.id), "expires_in": LIVE_TICKET_SECONDS})
+
+
+class ForecastSummaryView(APIView):
+    """
+    An API view summarizing the stored forecasts of many cities for the next hours.
+
+    Cities are given as ``?cities=1,2,3``; without it the cities the user is subscribed to are used.
+    """
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+
+    def get(self, request):
+        hours = forecast_hours(request)
+        if 'cities' in request.query_params:
+            try:
+                city_ids = [int(city_id) for city_id in request.query_params['cities'].split(',') if city_id]
+            except ValueError:
+                raise ValidationError({"cities": "Must be a comma-separated list of city ids."})
+        else:
+            city_ids = City.objects.filter(subscriptions__user_id=request.user.id).values_list('id', flat=True)
+        now_dt = datetime.now(timezone.utc)
+        forecasts = latest_forecasts(city_ids)
+        names = dict(City.objects.filter(id__in=forecasts).values_list('id', 'name'))
+        return Response([
+            {"city_id": city_id, "city": names[city_id], **summarize_window(forecast_window(forecast, now_dt, hours))}
+            for city_id, forecast in forecasts.items()
+        ])